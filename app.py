@@ -2,20 +2,30 @@ from __future__ import annotations
 
 import os
 import json
+import asyncio
 import hmac
 import time
-import html
 import base64
 import hashlib
+import functools
 import secrets
 import re
 import datetime
 import ssl
 import socket
-from typing import Any, Dict, List, Optional, Tuple
-
-from fastapi import FastAPI, Request
+import threading
+import logging
+import logging.handlers
+import queue
+import sys
+import atexit
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi import BackgroundTasks, FastAPI, Request
 from fastapi.responses import HTMLResponse, RedirectResponse, PlainTextResponse, FileResponse
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.sessions import SessionMiddleware
 
 # Optional deps – app ma działać bez konfiguracji
@@ -29,6 +39,11 @@ try:
 except Exception:
     stripe = None  # type: ignore
 
+try:
+    import orjson
+except Exception:
+    orjson = None  # type: ignore
+
 
 # =========================
 # 0) KONFIG – ENV (Render)
@@ -36,6 +51,15 @@ except Exception:
 
 APP_NAME = "ArchiBot"
 DATA_FILE = os.getenv("DATA_FILE", "data.json")
+# Zapisy bazy w krótkim oknie są sklejane w jeden (0 = zapis natychmiast); zła wartość w ENV -> domyślne 50
+try:
+    DB_SAVE_DELAY_MS = max(0, int(os.getenv("DB_SAVE_DELAY_MS", "50")))
+except ValueError:
+    DB_SAVE_DELAY_MS = 50
+# Opcjonalnie: każda firma w osobnym pliku (np. DB_SHARD_DIR=companies); DATA_FILE trzyma wtedy tylko indeks
+DB_SHARD_DIR = os.getenv("DB_SHARD_DIR", "").strip()
+# Plik bazy zapisujemy kompaktowo; DB_PRETTY_JSON=true włącza wcięcia (np. do ręcznego podglądu)
+DB_PRETTY_JSON = (os.getenv("DB_PRETTY_JSON", "false").lower() in ("1", "true", "yes", "y", "on"))
 
 # Base URL (Render): https://archibot.onrender.com
 BASE_URL = os.getenv("BASE_URL", "http://localhost:8000").rstrip("/")
@@ -43,6 +67,13 @@ BASE_URL = os.getenv("BASE_URL", "http://localhost:8000").rstrip("/")
 # Sesje (Render ENV ma: SESSION_SECRET)
 SESSION_SECRET = os.getenv("SESSION_SECRET", "").strip()
 
+# Liczba zaufanych proxy przed aplikacją (Render: 1). Przy N > 0 IP klienta to N-ty wpis X-Forwarded-For od końca
+# (wpisy dopisane przez nasze proxy); domyślnie 0 – nagłówek pochodzi od klienta, więc go nie czytamy.
+try:
+    FORWARDED_PROXY_HOPS = max(0, int(os.getenv("FORWARDED_PROXY_HOPS", "0")))
+except ValueError:
+    FORWARDED_PROXY_HOPS = 0
+
 # OpenAI
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "").strip()
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-5")
@@ -67,6 +98,34 @@ STRIPE_PRICE_ID_YEARLY = os.getenv("STRIPE_PRICE_ID_YEARLY", "").strip()
 # DEV bypass (Render ENV ma: DEV_BYPASS_SUBSCRIPTION)
 DEV_BYPASS_SUBSCRIPTION = (os.getenv("DEV_BYPASS_SUBSCRIPTION", "false").lower() in ("1", "true", "yes", "y", "on"))
 
+# Logi: handler tylko wrzuca rekord do kolejki, zapis na stdout robi osobny wątek (QueueListener)
+_log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+_log_stream = logging.StreamHandler(sys.stdout)
+_log_stream.setFormatter(logging.Formatter("%(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream)
+_log_listener.start()
+
+def _restart_log_listener() -> None:
+    """Po fork (np. gunicorn --preload) wątek listenera nie istnieje w dziecku – bez nowego
+    rekordy zostałyby w kolejce. Nowy listener na tej samej kolejce."""
+    global _log_listener
+    _log_listener = logging.handlers.QueueListener(_log_queue, _log_stream)
+    _log_listener.start()
+
+def _stop_log_listener() -> None:
+    # stop() czeka, aż wątek wypisze wszystko z kolejki; przez globalną nazwę – po fork to listener dziecka
+    _log_listener.stop()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_log_listener)
+# Rejestrowane przed atexit z _flush_db (atexit idzie od końca) – logi z ostatniego zapisu też wyjdą
+atexit.register(_stop_log_listener)
+
+log = logging.getLogger("archibot")
+log.setLevel(logging.INFO)
+log.addHandler(logging.handlers.QueueHandler(_log_queue))
+log.propagate = False
+
 
 # =========================
 # 1) KOSZT BUDOWY (V1: tabela założeń) – (pozostawiam bez zmian)
@@ -85,6 +144,12 @@ REGION_MULTIPLIER = {
     "Wieś": 0.95,
 }
 
+def _cost_basis(form: Dict[str, Any]) -> Tuple[str, str, int, float]:
+    """(standard, region, PLN/m², mnożnik regionu) z briefu – wspólne dla raportu AI i trybu bez AI."""
+    standard = form.get("cost_standard") or "Standard"
+    region = form.get("region_type") or "Mniejsze miasto / okolice"
+    return standard, region, BUILD_COST_M2_PLN.get(standard, BUILD_COST_M2_PLN["Standard"]), REGION_MULTIPLIER.get(region, 1.0)
+
 
 
 # =========================
@@ -241,411 +306,660 @@ REPORT_SCHEMA = {
 # 2) FORMULARZ – BUDYNKI PRZEMYSŁOWE (wersja rozszerzona)
 # =========================
 
-Field = Dict[str, Any]
-Section = Tuple[str, List[Field]]
-
-def _yn_unknown() -> List[str]:
-    return ["Tak", "Nie", "Nie wiem"]
-
-def _priority() -> List[str]:
-    return ["Czas", "Budżet", "Jakość", "Elastyczność (rozbudowa/zmiana procesu)", "Zgodność / audyty (PPOŻ/BHP/ESG)"]
-
-def _project_type() -> List[str]:
-    return ["Nowy obiekt", "Rozbudowa", "Przebudowa/modernizacja", "Adaptacja istniejącego budynku", "Etapowanie (wielofazowo)"]
-
-def _object_type() -> List[str]:
-    return [
-        "Hala produkcyjna",
-        "Hala magazynowa",
-        "Centrum logistyczne (cross-dock)",
-        "Zakład przemysłowy (złożony)",
-        "Hala montażowa",
-        "Chłodnia",
-        "Mroźnia",
-        "Obiekt ATEX / strefy wybuchowe",
-        "Laboratoria / R&D",
-        "Inne (opisz)",
-    ]
-
-def _roof_type() -> List[str]:
-    return ["Płaski", "Jednospadowy", "Dwuspadowy", "Inny", "Nie wiem"]
-
-def _construction_pref() -> List[str]:
-    return ["Stal", "Żelbet", "Prefabrykat", "Mieszana", "Nie wiem"]
-
-def _flooring_types() -> List[str]:
-    return [
-        "Posadzka przemysłowa (standard)",
-        "Posadzka o podwyższonej nośności",
-        "Posadzka antyelektrostatyczna (ESD)",
-        "Posadzka chemoodporna",
-        "Posadzka spożywcza (HACCP – specjalne wykończenie)",
-        "Inna / strefowana (opisz)",
-    ]
-
-def _forklift_types() -> List[str]:
-    return ["Elektryczne", "Spalinowe LPG", "Diesel", "Wózki wysokiego składowania", "Wózki systemowe/VNA", "AGV/AMR", "Nie dotyczy / nie wiem"]
-
-def _audit_standards() -> List[str]:
-    return ["Brak", "ISO 9001", "ISO 14001", "ISO 45001", "HACCP", "BRC", "IFS", "GMP", "FDA", "ATEX", "Inne (opisz)"]
-
-def _sprinkler() -> List[str]:
-    return ["Wymagane", "Niewymagane", "Nie wiem", "Do potwierdzenia przez rzeczoznawcę"]
-
-def _docks() -> List[str]:
-    return ["Brak", "1–2", "3–5", "6–10", "11–20", "20+", "Nie wiem"]
-
-def _shifts() -> List[str]:
-    return ["1 zmiana", "2 zmiany", "3 zmiany", "Ruch ciągły 24/7", "Sezonowo", "Nie wiem"]
-
-def _power_supply() -> List[str]:
-    return ["Z sieci (operator)", "Własna stacja trafo", "Agregat", "UPS (krytyczne)", "Mieszane", "Nie wiem"]
-
-def _water_sources() -> List[str]:
-    return ["Sieć", "Studnia", "Mieszane", "Nie wiem"]
-
-def _sewage() -> List[str]:
-    return ["Kanalizacja sanitarna", "Zbiornik bezodpływowy", "Oczyszczalnia", "Mieszane", "Nie wiem"]
-
-def _rainwater() -> List[str]:
-    return ["Kanalizacja deszczowa", "Retencja + rozsączanie", "Zbiornik retencyjny", "Wykorzystanie technologiczne", "Nie wiem"]
-
-def _heating() -> List[str]:
-    return ["Gaz", "Pompa ciepła", "Sieć ciepłownicza", "Nagrzewnice (np. gazowe)", "Odzysk ciepła z procesu", "Elektryczne", "Nie wiem"]
-
-def _ventilation() -> List[str]:
-    return ["Grawitacyjna", "Mechaniczna", "Mechaniczna z odzyskiem", "Wentylacja technologiczna (opisz)", "Nie wiem"]
-
-def _security_level() -> List[str]:
-    return ["Standard", "Podwyższony (CCTV/KD/SSWiN)", "Wysoki (strefy krytyczne)", "Nie wiem"]
+@dataclass(slots=True, frozen=True)
+class Field:
+    """Pole formularza – niemutowalne, współdzielone przez render i _form_to_rows."""
+    name: str
+    label: str
+    type: str
+    options: Tuple[str, ...] = ()
+    ph: str = ""
+    min: Optional[int] = None
+    max: Optional[int] = None
+    multiple: bool = False
+
+
+# Listy opcji – krotki tworzone raz przy imporcie (wcześniej funkcje zwracające nową listę).
+# Identyczne listy (np. Tak/Nie/Nie wiem) przechodzą przez _opts i dzielą jedną instancję krotki.
+_OPT_REGISTRY: Dict[Tuple[str, ...], Tuple[str, ...]] = {}
+
+def _opts(*vals: str) -> Tuple[str, ...]:
+    t = tuple(sys.intern(v) for v in vals)
+    return _OPT_REGISTRY.setdefault(t, t)
+
+_YN_UNKNOWN: Tuple[str, ...] = _opts("Tak", "Nie", "Nie wiem")
+_PRIORITY: Tuple[str, ...] = _opts("Czas", "Budżet", "Jakość", "Elastyczność (rozbudowa/zmiana procesu)", "Zgodność / audyty (PPOŻ/BHP/ESG)")
+_PROJECT_TYPE: Tuple[str, ...] = _opts("Nowy obiekt", "Rozbudowa", "Przebudowa/modernizacja", "Adaptacja istniejącego budynku", "Etapowanie (wielofazowo)")
+_OBJECT_TYPE: Tuple[str, ...] = _opts(
+    "Hala produkcyjna",
+    "Hala magazynowa",
+    "Centrum logistyczne (cross-dock)",
+    "Zakład przemysłowy (złożony)",
+    "Hala montażowa",
+    "Chłodnia",
+    "Mroźnia",
+    "Obiekt ATEX / strefy wybuchowe",
+    "Laboratoria / R&D",
+    "Inne (opisz)",
+)
+_ROOF_TYPE: Tuple[str, ...] = _opts("Płaski", "Jednospadowy", "Dwuspadowy", "Inny", "Nie wiem")
+_CONSTRUCTION_PREF: Tuple[str, ...] = _opts("Stal", "Żelbet", "Prefabrykat", "Mieszana", "Nie wiem")
+_FLOORING_TYPES: Tuple[str, ...] = _opts(
+    "Posadzka przemysłowa (standard)",
+    "Posadzka o podwyższonej nośności",
+    "Posadzka antyelektrostatyczna (ESD)",
+    "Posadzka chemoodporna",
+    "Posadzka spożywcza (HACCP – specjalne wykończenie)",
+    "Inna / strefowana (opisz)",
+)
+_FORKLIFT_TYPES: Tuple[str, ...] = _opts("Elektryczne", "Spalinowe LPG", "Diesel", "Wózki wysokiego składowania", "Wózki systemowe/VNA", "AGV/AMR", "Nie dotyczy / nie wiem")
+_AUDIT_STANDARDS: Tuple[str, ...] = _opts("Brak", "ISO 9001", "ISO 14001", "ISO 45001", "HACCP", "BRC", "IFS", "GMP", "FDA", "ATEX", "Inne (opisz)")
+_SPRINKLER: Tuple[str, ...] = _opts("Wymagane", "Niewymagane", "Nie wiem", "Do potwierdzenia przez rzeczoznawcę")
+_DOCKS: Tuple[str, ...] = _opts("Brak", "1–2", "3–5", "6–10", "11–20", "20+", "Nie wiem")
+_SHIFTS: Tuple[str, ...] = _opts("1 zmiana", "2 zmiany", "3 zmiany", "Ruch ciągły 24/7", "Sezonowo", "Nie wiem")
+_POWER_SUPPLY: Tuple[str, ...] = _opts("Z sieci (operator)", "Własna stacja trafo", "Agregat", "UPS (krytyczne)", "Mieszane", "Nie wiem")
+_WATER_SOURCES: Tuple[str, ...] = _opts("Sieć", "Studnia", "Mieszane", "Nie wiem")
+_SEWAGE: Tuple[str, ...] = _opts("Kanalizacja sanitarna", "Zbiornik bezodpływowy", "Oczyszczalnia", "Mieszane", "Nie wiem")
+_RAINWATER: Tuple[str, ...] = _opts("Kanalizacja deszczowa", "Retencja + rozsączanie", "Zbiornik retencyjny", "Wykorzystanie technologiczne", "Nie wiem")
+_HEATING: Tuple[str, ...] = _opts("Gaz", "Pompa ciepła", "Sieć ciepłownicza", "Nagrzewnice (np. gazowe)", "Odzysk ciepła z procesu", "Elektryczne", "Nie wiem")
+_VENTILATION: Tuple[str, ...] = _opts("Grawitacyjna", "Mechaniczna", "Mechaniczna z odzyskiem", "Wentylacja technologiczna (opisz)", "Nie wiem")
+_SECURITY_LEVEL: Tuple[str, ...] = _opts("Standard", "Podwyższony (CCTV/KD/SSWiN)", "Wysoki (strefy krytyczne)", "Nie wiem")
+_OWNERSHIP: Tuple[str, ...] = _opts("Własność inwestora", "W trakcie nabycia", "Dzierżawa", "Najem", "Nie wiem")
+_SOIL: Tuple[str, ...] = _opts("Piaski", "Glina", "Iły", "Nasypy", "Mieszany", "Nie wiem")
+_GROUNDWATER: Tuple[str, ...] = _opts("< 1 m p.p.t.", "1–2 m p.p.t.", "2–5 m p.p.t.", "> 5 m p.p.t.", "Nie wiem")
+_FLOOD: Tuple[str, ...] = _opts("Tak", "Nie", "Nie wiem")
+_MPZP: Tuple[str, ...] = _opts("MPZP", "WZ", "Nie wiem", "W trakcie")
+_ACCESS_ROAD: Tuple[str, ...] = _opts("Bezpośredni", "Służebność", "Droga wewnętrzna", "Nie wiem")
+_LOAD_ZONE: Tuple[str, ...] = _opts("Brak", "Rampa", "Doki", "Rampa + doki", "Brak danych / do ustalenia")
+_PARKING_REQ: Tuple[str, ...] = _opts("Zgodnie z MPZP/WZ", "Minimalny", "Zwiększony (dużo pracowników)", "Nie wiem")
+_DELIVERY_WINDOWS: Tuple[str, ...] = _opts("Dzień (6–18)", "Noc (18–6)", "24/7", "Sezonowo", "Nie wiem")
+_NOISE: Tuple[str, ...] = _opts("< 50 dB(A)","50-70 dB(A)", "70–80 dB(A)", "80–90 dB(A)", "> 90 dB(A)", "Punktowo/impulsowo > 90 dB(A)", "Nie wiem")
+_DUST: Tuple[str, ...] = _opts("Brak", "Niskie (< 1 mg/m³)", "Średnie (1–5 mg/m³)", "Wysokie (> 5 mg/m³)", "Pyły palne/ATEX", "Nie wiem")
+_HAZARDS: Tuple[str, ...] = _opts("Brak", "Chemikalia", "Materiały łatwopalne", "ATEX", "Wysokie temperatury", "Niskie temperatury", "Inne (opisz)", "Nie wiem")
+_OFFICE_STANDARD: Tuple[str, ...] = _opts("Podstawowy", "Standard", "Wysoki", "Reprezentacyjny", "Nie wiem")
+_BIM: Tuple[str, ...] = _opts("Tak (BIM wymagany)", "Opcjonalnie", "Nie", "Nie wiem")
+_PROCUREMENT: Tuple[str, ...] = _opts("Generalny wykonawca", "Pakietowanie (branże)", "Zaprojektuj i wybuduj (D&B)", "Inwestor prowadzi przetarg", "Nie wiem")
+_CONTRACT_MODEL: Tuple[str, ...] = _opts("Ryczałt", "Kosztorysowe", "GMP", "Mieszane", "Nie wiem")
+_FIRE_LOAD: Tuple[str, ...] = _opts("Q <= 500", "500 < Q <= 1000", "1000 < Q <= 2000", "2000 < Q <= 4000", "Q > 4000", "Nie wiem")
+_PROCESS_TEMP: Tuple[str, ...] = _opts("Temperatura standardowa", "Kontrola temperatury", "Chłodnia", "Mroźnia", "Podwyższone temperatury", "Nie wiem")
+
+
+# Sekcje po tytule (kolejność zachowana) – dostęp do sekcji przez FORM_SCHEMA[tytuł]
+FORM_SCHEMA: "OrderedDict[str, Tuple[Field, ...]]" = OrderedDict((
+    ("A. Inwestor i struktura decyzyjna", (
+        Field("investor_company", "Nazwa inwestora / spółki", "text", ph="np. XYZ Sp. z o.o."),
+        Field("investor_legal_form", "Forma prawna", "text", ph="np. sp. z o.o."),
+        Field("investor_contact_name", "Osoba kontaktowa (imię i nazwisko)", "text"),
+        Field("investor_contact_role", "Rola / stanowisko osoby kontaktowej", "text", ph="np. Project Manager / Dyrektor Techniczny"),
+        Field("investor_email", "Email kontaktowy", "email"),
+        Field("investor_phone", "Telefon", "text"),
+        Field("decision_maker", "Kto podejmuje decyzje projektowe? (opis)", "textarea", ph="np. zarząd + centrala; akceptacje etapowe; terminy"),
+        Field("approval_workflow", "Proces akceptacji i czas decyzyjny (opis)", "textarea", ph="np. spotkania co tydzień; akceptacje w 72h; odbiory wewnętrzne"),
+        Field("stakeholders", "Interesariusze (BHP, ppoż, technologia, IT, FM, audyt) – kto jest po stronie inwestora?", "textarea"),
+        Field("previous_projects", "Doświadczenia z wcześniejszych inwestycji (co działało / co nie)", "textarea"),
+    )),
+
+    ("B. Podstawowe dane inwestycji", (
+        Field("investment_name", "Nazwa inwestycji / projekt roboczy", "text"),
+        Field("project_type", "Charakter inwestycji", "select", options=_PROJECT_TYPE),
+        Field("object_type", "Typ obiektu (główna funkcja)", "select", options=_OBJECT_TYPE),
+        Field("object_type_other", "Jeśli 'Inne' – doprecyzuj typ obiektu", "text"),
+        Field("business_goal", "Cel inwestycji (opis szczegółowy)", "textarea", ph="Co ma umożliwić obiekt? jakie KPI? jakie ograniczenia?"),
+        Field("horizon_years", "Horyzont użytkowania (lata) – założenie inwestora", "number", min=0),
+        Field("future_expansion", "Czy przewidujesz rozbudowę/etapowanie?", "select", options=_opts("Tak – rozbudowa w przyszłości", "Tak – etapowanie od startu", "Nie", "Nie wiem")),
+        Field("flexibility_priority", "Elastyczność procesu / możliwość zmiany układu w przyszłości", "select", options=_opts("Wysoka", "Średnia", "Niska", "Nie wiem")),
+        Field("critical_failure", "Co byłoby porażką inwestycji nawet jeśli obiekt powstanie? (opis)", "textarea"),
+        Field("must_secrets", "Poufność / NDA / ograniczenia publikacji (opis)", "textarea"),
+    )),
+
+    ("C. Lokalizacja i działka", (
+        Field("plot_address", "Adres / lokalizacja / park przemysłowy", "text"),
+        Field("plot_ewidencyjny", "Numer(y) działek ewidencyjnych", "text"),
+        Field("plot_pow_m2", "Powierzchnia działki [m²]", "number", min=0),
+        Field("ownership_status", "Status własności", "select", options=_OWNERSHIP),
+        Field("plot_shape", "Kształt działki (opis)", "textarea", ph="np. nieregularna, wąska; wjazd od..."),
+        Field("plot_slope", "Ukształtowanie terenu (opis)", "textarea", ph="płasko/spadek; kierunek spadku; niwelety jeśli znane"),
+        Field("world_sides", "Orientacja stron świata / wjazd / ekspozycja (jeśli znana)", "textarea"),
+        Field("neighbors_notes", "Sąsiedztwo i potencjalne kolizje (hałas, dojazd, ograniczenia)", "textarea"),
+        Field("environmental_history", "Historia terenu (zabudowa, zanieczyszczenia, rekultywacja) – opis", "textarea"),
+        Field("trees_inventory", "Zieleń / drzewa do zachowania lub usunięcia – opis", "textarea"),
+        Field("site_constraints", "Ograniczenia i odległości (las, linie, gazociągi, drogi, zalewy, linia brzegowa) – opis", "textarea"),
+        Field("flood_risk", "Ryzyko zalewowe / podmokły teren", "select", options=_FLOOD),
+    )),
+
+    ("D. Grunt i geotechnika", (
+        Field("geotech_opinion", "Opinia geotechniczna – posiadam", "checkbox"),
+        Field("soil_type", "Rodzaj gruntu (jeśli znany)", "select", options=_SOIL),
+        Field("groundwater_level", "Poziom wód gruntowych", "select", options=_GROUNDWATER),
+        Field("bearing_capacity", "Nośność gruntu / problemy geotechniczne (opis)", "textarea"),
+        Field("earthworks_limits", "Ograniczenia robót ziemnych (np. nasypy, skarpy, wymiana gruntu) – opis", "textarea"),
+        Field("foundation_preference", "Preferencja posadowienia (jeśli jest)", "select", options=_opts("Ławy/stopy", "Płyta fundamentowa", "Posadowienie specjalne", "Nie wiem")),
+    )),
+
+    ("E. Formalności, plan miejscowy, decyzje", (
+        Field("mpzp_or_wz", "Podstawa planistyczna", "select", options=_MPZP),
+        Field("mpzp_wz_extract", "Wypis i wyrys MPZP / decyzja WZ – posiadam", "checkbox"),
+        Field("kw_number", "Numer księgi wieczystej (jeśli jest)", "text"),
+        Field("land_register_extract", "Wypis z rejestru gruntów – posiadam", "checkbox"),
+        Field("right_to_dispose", "Oświadczenie o prawie do dysponowania nieruchomością – posiadam", "checkbox"),
+        Field("environment_decision", "Decyzja środowiskowa – posiadam / wymagana?", "select", options=_opts("Posiadam", "Wymagana – w trakcie", "Nie jest wymagana", "Nie wiem")),
+        Field("agri_exclusion", "Wyłączenie z produkcji rolnej – czy dotyczy / status (opis)/ klasa gruntu", "textarea"),
+        Field("water_law_permit", "Operat wodnoprawny / pozwolenie wodnoprawne - opis", "textarea"),
+        Field("heritage_protection", "Ochrona konserwatorska / strefy ochrony / stanowiska archeologiczne – status (opis)", "textarea"),
+        Field("legal_constraints", "Inne ograniczenia prawne (służebności, strefy, sieci) – opis", "textarea"),
+        Field("access_road", "Dostęp do drogi publicznej", "select", options=_ACCESS_ROAD),
+        Field("driveway_consent", "Zgoda/warunki zjazdu z drogi publicznej – posiadam", "checkbox"),
+    )),
+
+    ("F. Media i przyłącza (stan i wymagania)", (
+        Field("power_conditions", "Warunki przyłączenia energii elektrycznej – posiadam", "checkbox"),
+        Field("water_conditions", "Warunki przyłączenia wody – posiadam", "checkbox"),
+        Field("sewage_conditions", "Warunki kanalizacji sanitarnej – posiadam", "checkbox"),
+        Field("rainwater_conditions", "Warunki kanalizacji deszczowej / deszczówka – posiadam", "checkbox"),
+        Field("gas_conditions", "Warunki przyłączenia gazu – posiadam (jeśli dotyczy)", "checkbox"),
+        Field("mec_conditions", "Przyłącze do sieci ciepłowniczej / MEC – posiadam (jeśli dotyczy)", "checkbox"),
+        Field("power_supply", "Zasilanie energią – preferencja", "select", options=_POWER_SUPPLY),
+        Field("power_kw_now", "Moc przyłączeniowa – wymagana dziś [kW] (jeśli znana)", "number", min=0),
+        Field("power_kw_future", "Moc przyłączeniowa – docelowo (rezerwa) [kW] (jeśli znana)", "number", min=0),
+        Field("water_solution", "Źródło wody", "select", options=_WATER_SOURCES),
+        Field("water_m3_day", "Zużycie wody (szacunek) [m³/dobę] – jeśli znane", "number", min=0),
+        Field("sewage_solution", "Ścieki sanitarne – rozwiązanie", "select", options=_SEWAGE),
+        Field("tech_wastewater", "Ścieki technologiczne – czy występują? (opis składu / ilości)", "textarea"),
+        Field("rainwater_handling", "Wody opadowe – rozwiązanie", "select", options=_RAINWATER),
+        Field("rainwater_notes", "Wody opadowe – wymagania/ograniczenia (opis)", "textarea"),
+        Field("internet_fiber", "Światłowód / Internet", "select", options=_opts("Jest", "Brak", "Nie wiem")),
+    )),
+
+    ("G. Program funkcjonalny – strefy i powierzchnie", (
+        Field("program_overview", "Opis funkcji i stref (jak ma działać obiekt) – opis", "textarea"),
+        Field("usable_area_m2", "Docelowa powierzchnia użytkowa (łącznie) [m²]", "number", min=0),
+        Field("production_area_m2", "Strefa produkcji [m²] (jeśli dotyczy)", "number", min=0),
+        Field("warehouse_area_m2", "Strefa magazynu [m²] (jeśli dotyczy)", "number", min=0),
+        Field("shipping_area_m2", "Strefa wysyłki/kompletacji [m²] (jeśli dotyczy)", "number", min=0),
+        Field("office_area_m2", "Biura [m²] (jeśli dotyczy)", "number", min=0),
+        Field("social_area_m2", "Zaplecze socjalne [m²] (szatnie, jadalnia, sanitariaty)", "number", min=0),
+        Field("tech_area_m2", "Pomieszczenia techniczne [m²] (rozdzielnia, sprężarkownia itp.)", "number", min=0),
+        Field("special_zones", "Strefy specjalne (laboratoria, clean room, chłodnia, ATEX) – opis", "textarea"),
+        Field("mezzanine", "Antresola / piętro technologiczne – czy przewidujesz? (opis)", "textarea"),
+    )),
+
+    ("H. Proces technologiczny (to determinuje projekt)", (
+        Field("process_description", "Opis procesu krok po kroku (wejście materiałów → proces → wyjście) – opis", "textarea"),
+        Field("materials_in", "Materiały wejściowe: rodzaj, ilości, forma dostaw (opis)", "textarea"),
+        Field("products_out", "Produkty wyjściowe: rodzaj, ilości, forma wysyłek (opis)", "textarea"),
+        Field("process_temp", "Wymagania temperaturowe procesu", "select", options=_PROCESS_TEMP),
+        Field("process_humidity", "Wymagania dot. wilgotności (jeśli dotyczy) – opis", "textarea"),
+        Field("noise_level", "Hałas procesu (szacunek)", "select", options=_NOISE),
+        Field("dust_level", "Pylenie / emisje (szacunek)", "select", options=_DUST),
+        Field("hazards", "Zagrożenia (chemikalia, ATEX, łatwopalne, temperatury) – wybierz", "select", options=_HAZARDS),
+        Field("hazards_notes", "Zagrożenia – szczegóły (substancje, ilości, SDS/MSDS, klasy) – opis", "textarea"),
+        Field("equipment_list", "Urządzenia / linie technologiczne (lista + gabaryty + masa + media) – opis", "textarea"),
+        Field("process_changes", "Czy proces może się zmieniać (modernizacje / nowe linie)? – opis", "textarea"),
+        Field("downtime_constraints", "Ograniczenia przestojów (ciągłość pracy, redundancje) – opis", "textarea"),
+    )),
+
+    ("I. Wymiary hali i parametry przestrzenne", (
+        Field("building_length_m", "Długość budynku [m] (jeśli znana)", "number", min=0),
+        Field("building_width_m", "Szerokość budynku [m] (jeśli znana)", "number", min=0),
+        Field("clear_height_m", "Wysokość do spodu konstrukcji (clear height) [m] – jeśli znana", "number", min=0),
+        Field("building_height_m", "Wysokość całkowita budynku [m] (jeśli wymagana/znana)", "number", min=0),
+        Field("storeys", "Kondygnacje (opis)", "textarea", ph="np. hala 1 kond., biura 2 kond."),
+        Field("roof_type", "Typ dachu", "select", options=_ROOF_TYPE),
+        Field("roof_area_m2", "Szacowana powierzchnia dachu [m²] (jeśli znana)", "number", min=0),
+        Field("daylight", "Doświetlenie: okna / świetliki / pasma – wymagania (opis)", "textarea"),
+        Field("crane_needed", "Suwnica – czy przewidujesz?", "select", options=_opts("Tak", "Nie", "Nie wiem")),
+        Field("crane_params", "Suwnica – parametry (udźwig, rozpiętość, wysokość podnoszenia, ilość) – opis", "textarea"),
+    )),
+
+    ("J. Posadzki, obciążenia, regały", (
+        Field("flooring_type", "Typ posadzki (preferencja)", "select", options=_FLOORING_TYPES),
+        Field("floor_load_kn_m2", "Obciążenia na posadzkę [kN/m²] (jeśli znane)", "number", min=0),
+        Field("point_loads", "Obciążenia skupione (maszyny/regaty/słupy) – opis", "textarea"),
+        Field("racking_system", "System składowania (regały, automatyka, wysokości) – opis", "textarea"),
+        Field("floor_flatness", "Wymagana płaskość posadzki (FF/FL / VNA) – opis", "textarea"),
+        Field("internal_plinths", "Cokoły wewnętrzne / odboje / zabezpieczenia ścian – opis", "textarea"),
+    )),
+
+    ("K. Bramy, doki, rampy, komunikacja logistyczna", (
+        Field("loading_zone", "Strefa załadunku/rozładunku", "select", options=_LOAD_ZONE),
+        Field("docks_count", "Liczba doków", "select", options=_DOCKS),
+        Field("dock_notes", "Doki – typy, wymagania, obciążenia, wyposażenie (opis)", "textarea"),
+        Field("ramps", "Rampy – czy wymagane? (opis)", "textarea"),
+        Field("gates_types", "Bramy – typy (segmentowe/rolowane/przesuwne/szybkobieżne) – opis", "textarea"),
+        Field("gates_dimensions", "Bramy – wymiary (światło przejazdu) i ilość – opis", "textarea"),
+        Field("delivery_windows", "Okna czasowe dostaw", "select", options=_DELIVERY_WINDOWS),
+        Field("truck_yard", "Plac manewrowy (TIR) – wymagania, ilość stanowisk, promienie – opis", "textarea"),
+        Field("internal_transport", "Transport wewnętrzny (wózki/AGV/suwnice) – opis", "textarea"),
+        Field("forklift_types", "Rodzaj wózków widłowych (dominujący)", "select", options=_FORKLIFT_TYPES),
+        Field("forklift_count", "Liczba wózków / urządzeń transportu wewnętrznego (szacunek)", "number", min=0),
+        Field("pedestrian_separation", "Separacja ruchu pieszego i kołowego (wymagania) – opis", "textarea"),
+    )),
+
+    ("L. Konstrukcja i obudowa", (
+        Field("construction_pref", "Preferowana technologia konstrukcyjna", "select", options=_CONSTRUCTION_PREF),
+        Field("column_grid", "Rozstaw osi słupów / siatka konstrukcyjna (jeśli narzucona) – opis", "textarea"),
+        Field("envelope_materials", "Obudowa/elewacje (płyta warstwowa, prefabrykat, inne) – opis", "textarea"),
+        Field("roof_covering", "Pokrycie dachu / wymagania (membrana, płyta, klapy) – opis", "textarea"),
+        Field("thermal_requirements", "Wymagania termiczne (U, szczelność, mostki) – opis", "textarea"),
+        Field("acoustic_requirements", "Wymagania akustyczne (wewn./zewn.) – opis", "textarea"),
+        Field("durability_requirements", "Wymagania trwałości/odporności (uderzenia, chemia, korozja) – opis", "textarea"),
+    )),
+
+    ("M. Instalacje – wymagania szczegółowe", (
+        Field("heating", "Ogrzewanie – preferowane źródło", "select", options=_HEATING),
+        Field("ventilation", "Wentylacja – preferencja", "select", options=_VENTILATION),
+        Field("process_exhaust", "Wyciągi/odpylanie/filtracja – wymagania (opis)", "textarea"),
+        Field("compressed_air", "Sprężone powietrze – czy wymagane? parametry (opis)", "textarea"),
+        Field("compressor_room", "Sprężarkownia – czy przewidujesz? lokalizacja/hałas/serwis (opis)", "textarea"),
+        Field("steam", "Para technologiczna – czy wymagana? (opis)", "textarea"),
+        Field("cooling", "Chłodzenie technologiczne / woda lodowa – wymagania (opis)", "textarea"),
+        Field("gas_usage", "Gaz – czy używany w procesie? (opis)", "textarea"),
+        Field("water_tech", "Woda technologiczna – parametry jakościowe / uzdatnianie (opis)", "textarea"),
+        Field("drain_tech", "Odwodnienia technologiczne, separatory, neutralizacja (opis)", "textarea"),
+        Field("electrical_critical", "Zasilanie krytyczne (UPS/agregat/redundancja) – opis", "textarea"),
+        Field("lighting_requirements", "Oświetlenie (lux, strefy, automatyka, awaryjne) – opis", "textarea"),
+        Field("bms", "BMS / automatyka budynkowa – zakres (opis)", "textarea"),
+    )),
+
+    ("N. PPOŻ – kluczowe dane wejściowe", (
+        Field("fire_water_availability", "Dostępność wody do gaszenia pożaru (hydranty, zbiorniki, wydajność) – opis", "textarea"),
+        Field("sprinkler", "Instalacja tryskaczowa – status", "select", options=_SPRINKLER),
+        Field("fire_load", "Obciążenie ogniowe Q(MJ/m²)", "select", options=_FIRE_LOAD),
+        Field("stored_materials", "Rodzaj magazynowanego materiału + ilości + sposób składowania (opis)", "textarea"),
+        Field("fire_zones", "Podział na strefy pożarowe (jeśli narzucony) – opis", "textarea"),
+        Field("smoke_exhaust", "Oddymianie / klapy dymowe / pasma – wymagania (opis)", "textarea"),
+        Field("fire_alarm", "SSP/DSO/monitoring pożarowy – wymagania inwestora (opis)", "textarea"),
+        Field("fire_consultant", "Czy inwestor ma rzeczoznawcę ppoż / standard korporacyjny? (opis)", "textarea"),
+    )),
+
+    ("O. BHP / ergonomia / ryzyka operacyjne", (
+        Field("hse_risks", "Ryzyka BHP (chemia, hałas, pyły, ruch pojazdów) – opis", "textarea"),
+        Field("ppe_zones", "Strefy wymagające ŚOI / procedury wejścia – opis", "textarea"),
+        Field("emergency_procedures", "Procedury awaryjne (ewakuacja, wycieki, awaria zasilania) – opis", "textarea"),
+        Field("safety_barriers", "Wymagania barier/odbojów/siatek/kurtyn – opis", "textarea"),
+        Field("cleanliness", "Wymagania czystości (brudna/czysta, śluzy, strefowanie) – opis", "textarea"),
+    )),
+
+    ("P. Zatrudnienie, zmiany, socjal", (
+        Field("shifts", "Tryb pracy", "select", options=_SHIFTS),
+        Field("workers_total", "Liczba pracowników (łącznie) – szacunek", "number", min=0),
+        Field("workers_per_shift", "Liczba pracowników na zmianie – szacunek", "number", min=0),
+        Field("office_staff", "Liczba pracowników biurowych – szacunek", "number", min=0),
+        Field("gender_split", "Struktura (opcjonalnie): kobiety/mężczyźni (dla szatni/sanitariatów) – opis", "textarea"),
+        Field("social_requirements", "Zaplecze socjalne (szatnie czysta/brudna, prysznice, jadalnia) – opis", "textarea"),
+        Field("office_standard", "Standard części biurowej", "select", options=_OFFICE_STANDARD),
+        Field("visitor_flow", "Ruch gości / recepcja / strefy reprezentacyjne – opis", "textarea"),
+    )),
+
+    ("Q. IT / bezpieczeństwo / ochrona", (
+        Field("security_level", "Poziom zabezpieczeń", "select", options=_SECURITY_LEVEL),
+        Field("cctv", "CCTV – zakres (strefy, retencja nagrań) – opis", "textarea"),
+        Field("access_control", "Kontrola dostępu (KD) – zakres (strefy, uprawnienia) – opis", "textarea"),
+        Field("intrusion", "SSWiN / ochrona fizyczna – opis", "textarea"),
+        Field("it_rooms", "Serwerownia / teletechnika – wymagania (klima, UPS, redundancja) – opis", "textarea"),
+        Field("network_requirements", "Sieć (Wi-Fi przemysłowe, IoT, OT/SCADA) – opis", "textarea"),
+    )),
+
+    ("R. Standardy, audyty, wymagania korporacyjne", (
+        Field("audit_standards", "Standardy / audyty (wybierz)", "select", options=_AUDIT_STANDARDS),
+        Field("audit_notes", "Wymagania audytowe i korporacyjne (materiały, procedury, układ) – opis", "textarea"),
+        Field("bim_requirement", "BIM", "select", options=_BIM),
+        Field("design_guidelines", "Wytyczne inwestora (brandbook, standard obiektów) – opis", "textarea"),
+    )),
+
+    ("S. Zewnętrzne zagospodarowanie terenu", (
+        Field("parking_policy", "Parkingi – założenia", "select", options=_PARKING_REQ),
+        Field("parking_counts", "Liczba miejsc: osobowe / ciężarowe / rowery (jeśli znane) – opis", "textarea"),
+        Field("roads_internal", "Drogi wewnętrzne, place, nawierzchnie – wymagania (opis)", "textarea"),
+        Field("fence", "Ogrodzenie – czy wymagane?", "select", options=_opts("Tak", "Nie", "Nie wiem")),
+        Field("gatehouse", "Portiernia / wjazd kontrolowany – wymagania (opis)", "textarea"),
+        Field("stormwater_retention", "Retencja / zbiorniki / zrzut deszczówki – wymagania (opis)", "textarea"),
+        Field("external_storage", "Składowanie zewnętrzne (kontenery, odpady, palety) – opis", "textarea"),
+        Field("waste_management", "Gospodarka odpadami (rodzaje, ilości, lokalizacja, segregacja) – opis", "textarea"),
+    )),
+
+    ("T. Budżet, harmonogram, ryzyka", (
+        Field("budget_total", "Budżet całej inwestycji [PLN] (jeśli jest)", "number", min=0),
+        Field("budget_build_only", "Budżet budowy (bez gruntu) [PLN] (jeśli jest)", "number", min=0),
+        Field("timeline_start", "Planowany start prac (projekt/budowa) – opis", "textarea"),
+        Field("timeline_deadline", "Termin oddania / uruchomienia (czy jest krytyczny?) – opis", "textarea"),
+        Field("priority", "Priorytet projektu", "select", options=_PRIORITY),
+        Field("risk_register", "Ryzyka zidentyfikowane przez inwestora (formalno-prawne, techniczne, operacyjne) – opis", "textarea"),
+        Field("no_go", "Warunki 'no-go' (czego nie wolno przekroczyć) – opis", "textarea"),
+        Field("unknowns", "Obszary nieustalone (co wymaga doprecyzowania) – opis", "textarea"),
+        Field("must_have", "Must-have (wymagania bezwzględne) – opis", "textarea"),
+        Field("nice_to_have", "Nice-to-have (mile widziane) – opis", "textarea"),
+        Field("dont_want", "Czego na pewno nie chcesz – opis", "textarea"),
+    )),
+
+    ("U. Załączniki (opcjonalnie)", (
+        Field("attachments", "Pliki (MPZP/WZ, mapa, geotechnika, warunki przyłączy, proces/technologia, szkice)", "file", multiple=True),
+    )),
+))
+
+# Płaski indeks po nazwie pola – jedno wyszukanie w dict zamiast przechodzenia sekcji (_form_value, _form_to_rows)
+FIELD_INDEX: Dict[str, Field] = {f.name: f for fields in FORM_SCHEMA.values() for f in fields}
+
+def _form_value(name: str, v: Any) -> Any:
+    """Wartość pola z POST: select wysyła numer opcji – zamieniamy go z powrotem na etykietę z FORM_SCHEMA
+    (wartości tekstowe, np. ze starszej wersji formularza, zostają bez zmian); checkbox "1" -> True."""
+    f = FIELD_INDEX.get(name)
+    # isdigit() przepuszcza też "²" czy "١" – int() by ich nie przyjął
+    if f is not None and f.options and isinstance(v, str) and v.isascii() and v.isdigit():
+        i = int(v)
+        if i < len(f.options):
+            return f.options[i]
+    return True if v == "1" else v
+
+class SectionSoA(NamedTuple):
+    """Sekcja w układzie kolumnowym: równoległe krotki zamiast krotki pól."""
+    names: Tuple[str, ...]
+    labels: Tuple[str, ...]
+
+# Budowane raz z FORM_SCHEMA (leniwie, przy pierwszym użyciu). Tylko kolumny, które ktoś czyta (_schema_flat);
+# render formularza i _form_value korzystają z obiektów Field.
+@functools.lru_cache(maxsize=None)
+def form_schema_soa() -> Tuple[Tuple[str, SectionSoA], ...]:
+    return tuple(
+        (title, SectionSoA(
+            names=tuple(f.name for f in fields),
+            labels=tuple(f.label for f in fields),
+        ))
+        for title, fields in FORM_SCHEMA.items()
+    )
 
-def _ownership() -> List[str]:
-    return ["Własność inwestora", "W trakcie nabycia", "Dzierżawa", "Najem", "Nie wiem"]
-
-def _soil() -> List[str]:
-    return ["Piaski", "Glina", "Iły", "Nasypy", "Mieszany", "Nie wiem"]
-
-def _groundwater() -> List[str]:
-    return ["< 1 m p.p.t.", "1–2 m p.p.t.", "2–5 m p.p.t.", "> 5 m p.p.t.", "Nie wiem"]
-    
-
-def _flood() -> List[str]:
-    return ["Tak", "Nie", "Nie wiem"]
-
-def _mpzp() -> List[str]:
-    return ["MPZP", "WZ", "Nie wiem", "W trakcie"]
-
-def _access_road() -> List[str]:
-    return ["Bezpośredni", "Służebność", "Droga wewnętrzna", "Nie wiem"]
-
-def _load_zone() -> List[str]:
-    return ["Brak", "Rampa", "Doki", "Rampa + doki", "Brak danych / do ustalenia"]
-
-def _parking_req() -> List[str]:
-    return ["Zgodnie z MPZP/WZ", "Minimalny", "Zwiększony (dużo pracowników)", "Nie wiem"]
-
-def _delivery_windows() -> List[str]:
-    return ["Dzień (6–18)", "Noc (18–6)", "24/7", "Sezonowo", "Nie wiem"]
-
-def _noise() -> List[str]:
-    return ["< 50 dB(A)","50-70 dB(A)", "70–80 dB(A)", "80–90 dB(A)", "> 90 dB(A)", "Punktowo/impulsowo > 90 dB(A)", "Nie wiem"]
-    
-def _dust() -> List[str]:
-    return ["Brak", "Niskie (< 1 mg/m³)", "Średnie (1–5 mg/m³)", "Wysokie (> 5 mg/m³)", "Pyły palne/ATEX", "Nie wiem"]
-
-def _hazards() -> List[str]:
-    return ["Brak", "Chemikalia", "Materiały łatwopalne", "ATEX", "Wysokie temperatury", "Niskie temperatury", "Inne (opisz)", "Nie wiem"]
-
-def _office_standard() -> List[str]:
-    return ["Podstawowy", "Standard", "Wysoki", "Reprezentacyjny", "Nie wiem"]
-
-def _bim() -> List[str]:
-    return ["Tak (BIM wymagany)", "Opcjonalnie", "Nie", "Nie wiem"]
-
-def _procurement() -> List[str]:
-    return ["Generalny wykonawca", "Pakietowanie (branże)", "Zaprojektuj i wybuduj (D&B)", "Inwestor prowadzi przetarg", "Nie wiem"]
-
-def _contract_model() -> List[str]:
-    return ["Ryczałt", "Kosztorysowe", "GMP", "Mieszane", "Nie wiem"]
-
-def _fire_load() -> List[str]:
-    return ["Q <= 500", "500 < Q <= 1000", "1000 < Q <= 2000", "2000 < Q <= 4000", "Q > 4000", "Nie wiem"]
-
-def _process_temp() -> List[str]:
-    return ["Temperatura standardowa", "Kontrola temperatury", "Chłodnia", "Mroźnia", "Podwyższone temperatury", "Nie wiem"]
-
-
-FORM_SCHEMA: List[Section] = [
-    ("A. Inwestor i struktura decyzyjna", [
-        {"name": "investor_company", "label": "Nazwa inwestora / spółki", "type": "text", "ph": "np. XYZ Sp. z o.o."},
-        {"name": "investor_legal_form", "label": "Forma prawna", "type": "text", "ph": "np. sp. z o.o."},
-        {"name": "investor_contact_name", "label": "Osoba kontaktowa (imię i nazwisko)", "type": "text"},
-        {"name": "investor_contact_role", "label": "Rola / stanowisko osoby kontaktowej", "type": "text", "ph": "np. Project Manager / Dyrektor Techniczny"},
-        {"name": "investor_email", "label": "Email kontaktowy", "type": "email"},
-        {"name": "investor_phone", "label": "Telefon", "type": "text"},
-        {"name": "decision_maker", "label": "Kto podejmuje decyzje projektowe? (opis)", "type": "textarea", "ph": "np. zarząd + centrala; akceptacje etapowe; terminy"},
-        {"name": "approval_workflow", "label": "Proces akceptacji i czas decyzyjny (opis)", "type": "textarea", "ph": "np. spotkania co tydzień; akceptacje w 72h; odbiory wewnętrzne"},
-        {"name": "stakeholders", "label": "Interesariusze (BHP, ppoż, technologia, IT, FM, audyt) – kto jest po stronie inwestora?", "type": "textarea"},
-        {"name": "previous_projects", "label": "Doświadczenia z wcześniejszych inwestycji (co działało / co nie)", "type": "textarea"},
-    ]),
-
-    ("B. Podstawowe dane inwestycji", [
-        {"name": "investment_name", "label": "Nazwa inwestycji / projekt roboczy", "type": "text"},
-        {"name": "project_type", "label": "Charakter inwestycji", "type": "select", "options": _project_type()},
-        {"name": "object_type", "label": "Typ obiektu (główna funkcja)", "type": "select", "options": _object_type()},
-        {"name": "object_type_other", "label": "Jeśli 'Inne' – doprecyzuj typ obiektu", "type": "text"},
-        {"name": "business_goal", "label": "Cel inwestycji (opis szczegółowy)", "type": "textarea", "ph": "Co ma umożliwić obiekt? jakie KPI? jakie ograniczenia?"},
-        {"name": "horizon_years", "label": "Horyzont użytkowania (lata) – założenie inwestora", "type": "number", "min": 0},
-        {"name": "future_expansion", "label": "Czy przewidujesz rozbudowę/etapowanie?", "type": "select", "options": ["Tak – rozbudowa w przyszłości", "Tak – etapowanie od startu", "Nie", "Nie wiem"]},
-        {"name": "flexibility_priority", "label": "Elastyczność procesu / możliwość zmiany układu w przyszłości", "type": "select", "options": ["Wysoka", "Średnia", "Niska", "Nie wiem"]},
-        {"name": "critical_failure", "label": "Co byłoby porażką inwestycji nawet jeśli obiekt powstanie? (opis)", "type": "textarea"},
-        {"name": "must_secrets", "label": "Poufność / NDA / ograniczenia publikacji (opis)", "type": "textarea"},
-    ]),
-
-    ("C. Lokalizacja i działka", [
-        {"name": "plot_address", "label": "Adres / lokalizacja / park przemysłowy", "type": "text"},
-        {"name": "plot_ewidencyjny", "label": "Numer(y) działek ewidencyjnych", "type": "text"},
-        {"name": "plot_pow_m2", "label": "Powierzchnia działki [m²]", "type": "number", "min": 0},
-        {"name": "ownership_status", "label": "Status własności", "type": "select", "options": _ownership()},
-        {"name": "plot_shape", "label": "Kształt działki (opis)", "type": "textarea", "ph": "np. nieregularna, wąska; wjazd od..."},
-        {"name": "plot_slope", "label": "Ukształtowanie terenu (opis)", "type": "textarea", "ph": "płasko/spadek; kierunek spadku; niwelety jeśli znane"},
-        {"name": "world_sides", "label": "Orientacja stron świata / wjazd / ekspozycja (jeśli znana)", "type": "textarea"},
-        {"name": "neighbors_notes", "label": "Sąsiedztwo i potencjalne kolizje (hałas, dojazd, ograniczenia)", "type": "textarea"},
-        {"name": "environmental_history", "label": "Historia terenu (zabudowa, zanieczyszczenia, rekultywacja) – opis", "type": "textarea"},
-        {"name": "trees_inventory", "label": "Zieleń / drzewa do zachowania lub usunięcia – opis", "type": "textarea"},
-        {"name": "site_constraints", "label": "Ograniczenia i odległości (las, linie, gazociągi, drogi, zalewy, linia brzegowa) – opis", "type": "textarea"},
-        {"name": "flood_risk", "label": "Ryzyko zalewowe / podmokły teren", "type": "select", "options": _flood()},
-    ]),
-
-    ("D. Grunt i geotechnika", [
-        {"name": "geotech_opinion", "label": "Opinia geotechniczna – posiadam", "type": "checkbox"},
-        {"name": "soil_type", "label": "Rodzaj gruntu (jeśli znany)", "type": "select", "options": _soil()},
-        {"name": "groundwater_level", "label": "Poziom wód gruntowych", "type": "select", "options": _groundwater()},
-        {"name": "bearing_capacity", "label": "Nośność gruntu / problemy geotechniczne (opis)", "type": "textarea"},
-        {"name": "earthworks_limits", "label": "Ograniczenia robót ziemnych (np. nasypy, skarpy, wymiana gruntu) – opis", "type": "textarea"},
-        {"name": "foundation_preference", "label": "Preferencja posadowienia (jeśli jest)", "type": "select", "options": ["Ławy/stopy", "Płyta fundamentowa", "Posadowienie specjalne", "Nie wiem"]},
-    ]),
-
-    ("E. Formalności, plan miejscowy, decyzje", [
-        {"name": "mpzp_or_wz", "label": "Podstawa planistyczna", "type": "select", "options": _mpzp()},
-        {"name": "mpzp_wz_extract", "label": "Wypis i wyrys MPZP / decyzja WZ – posiadam", "type": "checkbox"},
-        {"name": "kw_number", "label": "Numer księgi wieczystej (jeśli jest)", "type": "text"},
-        {"name": "land_register_extract", "label": "Wypis z rejestru gruntów – posiadam", "type": "checkbox"},
-        {"name": "right_to_dispose", "label": "Oświadczenie o prawie do dysponowania nieruchomością – posiadam", "type": "checkbox"},
-        {"name": "environment_decision", "label": "Decyzja środowiskowa – posiadam / wymagana?", "type": "select", "options": ["Posiadam", "Wymagana – w trakcie", "Nie jest wymagana", "Nie wiem"]},
-        {"name": "agri_exclusion", "label": "Wyłączenie z produkcji rolnej – czy dotyczy / status (opis)/ klasa gruntu", "type": "textarea"},
-        {"name": "water_law_permit", "label": "Operat wodnoprawny / pozwolenie wodnoprawne - opis", "type": "textarea"},
-        {"name": "heritage_protection", "label": "Ochrona konserwatorska / strefy ochrony / stanowiska archeologiczne – status (opis)", "type": "textarea"},
-        {"name": "legal_constraints", "label": "Inne ograniczenia prawne (służebności, strefy, sieci) – opis", "type": "textarea"},
-        {"name": "access_road", "label": "Dostęp do drogi publicznej", "type": "select", "options": _access_road()},
-        {"name": "driveway_consent", "label": "Zgoda/warunki zjazdu z drogi publicznej – posiadam", "type": "checkbox"},
-    ]),
-
-    ("F. Media i przyłącza (stan i wymagania)", [
-        {"name": "power_conditions", "label": "Warunki przyłączenia energii elektrycznej – posiadam", "type": "checkbox"},
-        {"name": "water_conditions", "label": "Warunki przyłączenia wody – posiadam", "type": "checkbox"},
-        {"name": "sewage_conditions", "label": "Warunki kanalizacji sanitarnej – posiadam", "type": "checkbox"},
-        {"name": "rainwater_conditions", "label": "Warunki kanalizacji deszczowej / deszczówka – posiadam", "type": "checkbox"},
-        {"name": "gas_conditions", "label": "Warunki przyłączenia gazu – posiadam (jeśli dotyczy)", "type": "checkbox"},
-        {"name": "mec_conditions", "label": "Przyłącze do sieci ciepłowniczej / MEC – posiadam (jeśli dotyczy)", "type": "checkbox"},
-        {"name": "power_supply", "label": "Zasilanie energią – preferencja", "type": "select", "options": _power_supply()},
-        {"name": "power_kw_now", "label": "Moc przyłączeniowa – wymagana dziś [kW] (jeśli znana)", "type": "number", "min": 0},
-        {"name": "power_kw_future", "label": "Moc przyłączeniowa – docelowo (rezerwa) [kW] (jeśli znana)", "type": "number", "min": 0},
-        {"name": "water_solution", "label": "Źródło wody", "type": "select", "options": _water_sources()},
-        {"name": "water_m3_day", "label": "Zużycie wody (szacunek) [m³/dobę] – jeśli znane", "type": "number", "min": 0},
-        {"name": "sewage_solution", "label": "Ścieki sanitarne – rozwiązanie", "type": "select", "options": _sewage()},
-        {"name": "tech_wastewater", "label": "Ścieki technologiczne – czy występują? (opis składu / ilości)", "type": "textarea"},
-        {"name": "rainwater_handling", "label": "Wody opadowe – rozwiązanie", "type": "select", "options": _rainwater()},
-        {"name": "rainwater_notes", "label": "Wody opadowe – wymagania/ograniczenia (opis)", "type": "textarea"},
-        {"name": "internet_fiber", "label": "Światłowód / Internet", "type": "select", "options": ["Jest", "Brak", "Nie wiem"]},
-    ]),
-
-    ("G. Program funkcjonalny – strefy i powierzchnie", [
-        {"name": "program_overview", "label": "Opis funkcji i stref (jak ma działać obiekt) – opis", "type": "textarea"},
-        {"name": "usable_area_m2", "label": "Docelowa powierzchnia użytkowa (łącznie) [m²]", "type": "number", "min": 0},
-        {"name": "production_area_m2", "label": "Strefa produkcji [m²] (jeśli dotyczy)", "type": "number", "min": 0},
-        {"name": "warehouse_area_m2", "label": "Strefa magazynu [m²] (jeśli dotyczy)", "type": "number", "min": 0},
-        {"name": "shipping_area_m2", "label": "Strefa wysyłki/kompletacji [m²] (jeśli dotyczy)", "type": "number", "min": 0},
-        {"name": "office_area_m2", "label": "Biura [m²] (jeśli dotyczy)", "type": "number", "min": 0},
-        {"name": "social_area_m2", "label": "Zaplecze socjalne [m²] (szatnie, jadalnia, sanitariaty)", "type": "number", "min": 0},
-        {"name": "tech_area_m2", "label": "Pomieszczenia techniczne [m²] (rozdzielnia, sprężarkownia itp.)", "type": "number", "min": 0},
-        {"name": "special_zones", "label": "Strefy specjalne (laboratoria, clean room, chłodnia, ATEX) – opis", "type": "textarea"},
-        {"name": "mezzanine", "label": "Antresola / piętro technologiczne – czy przewidujesz? (opis)", "type": "textarea"},
-    ]),
-
-    ("H. Proces technologiczny (to determinuje projekt)", [
-        {"name": "process_description", "label": "Opis procesu krok po kroku (wejście materiałów → proces → wyjście) – opis", "type": "textarea"},
-        {"name": "materials_in", "label": "Materiały wejściowe: rodzaj, ilości, forma dostaw (opis)", "type": "textarea"},
-        {"name": "products_out", "label": "Produkty wyjściowe: rodzaj, ilości, forma wysyłek (opis)", "type": "textarea"},
-        {"name": "process_temp", "label": "Wymagania temperaturowe procesu", "type": "select", "options": _process_temp()},
-        {"name": "process_humidity", "label": "Wymagania dot. wilgotności (jeśli dotyczy) – opis", "type": "textarea"},
-        {"name": "noise_level", "label": "Hałas procesu (szacunek)", "type": "select", "options": _noise()},
-        {"name": "dust_level", "label": "Pylenie / emisje (szacunek)", "type": "select", "options": _dust()},
-        {"name": "hazards", "label": "Zagrożenia (chemikalia, ATEX, łatwopalne, temperatury) – wybierz", "type": "select", "options": _hazards()},
-        {"name": "hazards_notes", "label": "Zagrożenia – szczegóły (substancje, ilości, SDS/MSDS, klasy) – opis", "type": "textarea"},
-        {"name": "equipment_list", "label": "Urządzenia / linie technologiczne (lista + gabaryty + masa + media) – opis", "type": "textarea"},
-        {"name": "process_changes", "label": "Czy proces może się zmieniać (modernizacje / nowe linie)? – opis", "type": "textarea"},
-        {"name": "downtime_constraints", "label": "Ograniczenia przestojów (ciągłość pracy, redundancje) – opis", "type": "textarea"},
-    ]),
-
-    ("I. Wymiary hali i parametry przestrzenne", [
-        {"name": "building_length_m", "label": "Długość budynku [m] (jeśli znana)", "type": "number", "min": 0},
-        {"name": "building_width_m", "label": "Szerokość budynku [m] (jeśli znana)", "type": "number", "min": 0},
-        {"name": "clear_height_m", "label": "Wysokość do spodu konstrukcji (clear height) [m] – jeśli znana", "type": "number", "min": 0},
-        {"name": "building_height_m", "label": "Wysokość całkowita budynku [m] (jeśli wymagana/znana)", "type": "number", "min": 0},
-        {"name": "storeys", "label": "Kondygnacje (opis)", "type": "textarea", "ph": "np. hala 1 kond., biura 2 kond."},
-        {"name": "roof_type", "label": "Typ dachu", "type": "select", "options": _roof_type()},
-        {"name": "roof_area_m2", "label": "Szacowana powierzchnia dachu [m²] (jeśli znana)", "type": "number", "min": 0},
-        {"name": "daylight", "label": "Doświetlenie: okna / świetliki / pasma – wymagania (opis)", "type": "textarea"},
-        {"name": "crane_needed", "label": "Suwnica – czy przewidujesz?", "type": "select", "options": ["Tak", "Nie", "Nie wiem"]},
-        {"name": "crane_params", "label": "Suwnica – parametry (udźwig, rozpiętość, wysokość podnoszenia, ilość) – opis", "type": "textarea"},
-    ]),
-
-    ("J. Posadzki, obciążenia, regały", [
-        {"name": "flooring_type", "label": "Typ posadzki (preferencja)", "type": "select", "options": _flooring_types()},
-        {"name": "floor_load_kn_m2", "label": "Obciążenia na posadzkę [kN/m²] (jeśli znane)", "type": "number", "min": 0},
-        {"name": "point_loads", "label": "Obciążenia skupione (maszyny/regaty/słupy) – opis", "type": "textarea"},
-        {"name": "racking_system", "label": "System składowania (regały, automatyka, wysokości) – opis", "type": "textarea"},
-        {"name": "floor_flatness", "label": "Wymagana płaskość posadzki (FF/FL / VNA) – opis", "type": "textarea"},
-        {"name": "internal_plinths", "label": "Cokoły wewnętrzne / odboje / zabezpieczenia ścian – opis", "type": "textarea"},
-    ]),
-
-    ("K. Bramy, doki, rampy, komunikacja logistyczna", [
-        {"name": "loading_zone", "label": "Strefa załadunku/rozładunku", "type": "select", "options": _load_zone()},
-        {"name": "docks_count", "label": "Liczba doków", "type": "select", "options": _docks()},
-        {"name": "dock_notes", "label": "Doki – typy, wymagania, obciążenia, wyposażenie (opis)", "type": "textarea"},
-        {"name": "ramps", "label": "Rampy – czy wymagane? (opis)", "type": "textarea"},
-        {"name": "gates_types", "label": "Bramy – typy (segmentowe/rolowane/przesuwne/szybkobieżne) – opis", "type": "textarea"},
-        {"name": "gates_dimensions", "label": "Bramy – wymiary (światło przejazdu) i ilość – opis", "type": "textarea"},
-        {"name": "delivery_windows", "label": "Okna czasowe dostaw", "type": "select", "options": _delivery_windows()},
-        {"name": "truck_yard", "label": "Plac manewrowy (TIR) – wymagania, ilość stanowisk, promienie – opis", "type": "textarea"},
-        {"name": "internal_transport", "label": "Transport wewnętrzny (wózki/AGV/suwnice) – opis", "type": "textarea"},
-        {"name": "forklift_types", "label": "Rodzaj wózków widłowych (dominujący)", "type": "select", "options": _forklift_types()},
-        {"name": "forklift_count", "label": "Liczba wózków / urządzeń transportu wewnętrznego (szacunek)", "type": "number", "min": 0},
-        {"name": "pedestrian_separation", "label": "Separacja ruchu pieszego i kołowego (wymagania) – opis", "type": "textarea"},
-    ]),
-
-    ("L. Konstrukcja i obudowa", [
-        {"name": "construction_pref", "label": "Preferowana technologia konstrukcyjna", "type": "select", "options": _construction_pref()},
-        {"name": "column_grid", "label": "Rozstaw osi słupów / siatka konstrukcyjna (jeśli narzucona) – opis", "type": "textarea"},
-        {"name": "envelope_materials", "label": "Obudowa/elewacje (płyta warstwowa, prefabrykat, inne) – opis", "type": "textarea"},
-        {"name": "roof_covering", "label": "Pokrycie dachu / wymagania (membrana, płyta, klapy) – opis", "type": "textarea"},
-        {"name": "thermal_requirements", "label": "Wymagania termiczne (U, szczelność, mostki) – opis", "type": "textarea"},
-        {"name": "acoustic_requirements", "label": "Wymagania akustyczne (wewn./zewn.) – opis", "type": "textarea"},
-        {"name": "durability_requirements", "label": "Wymagania trwałości/odporności (uderzenia, chemia, korozja) – opis", "type": "textarea"},
-    ]),
-
-    ("M. Instalacje – wymagania szczegółowe", [
-        {"name": "heating", "label": "Ogrzewanie – preferowane źródło", "type": "select", "options": _heating()},
-        {"name": "ventilation", "label": "Wentylacja – preferencja", "type": "select", "options": _ventilation()},
-        {"name": "process_exhaust", "label": "Wyciągi/odpylanie/filtracja – wymagania (opis)", "type": "textarea"},
-        {"name": "compressed_air", "label": "Sprężone powietrze – czy wymagane? parametry (opis)", "type": "textarea"},
-        {"name": "compressor_room", "label": "Sprężarkownia – czy przewidujesz? lokalizacja/hałas/serwis (opis)", "type": "textarea"},
-        {"name": "steam", "label": "Para technologiczna – czy wymagana? (opis)", "type": "textarea"},
-        {"name": "cooling", "label": "Chłodzenie technologiczne / woda lodowa – wymagania (opis)", "type": "textarea"},
-        {"name": "gas_usage", "label": "Gaz – czy używany w procesie? (opis)", "type": "textarea"},
-        {"name": "water_tech", "label": "Woda technologiczna – parametry jakościowe / uzdatnianie (opis)", "type": "textarea"},
-        {"name": "drain_tech", "label": "Odwodnienia technologiczne, separatory, neutralizacja (opis)", "type": "textarea"},
-        {"name": "electrical_critical", "label": "Zasilanie krytyczne (UPS/agregat/redundancja) – opis", "type": "textarea"},
-        {"name": "lighting_requirements", "label": "Oświetlenie (lux, strefy, automatyka, awaryjne) – opis", "type": "textarea"},
-        {"name": "bms", "label": "BMS / automatyka budynkowa – zakres (opis)", "type": "textarea"},
-    ]),
-
-    ("N. PPOŻ – kluczowe dane wejściowe", [
-        {"name": "fire_water_availability", "label": "Dostępność wody do gaszenia pożaru (hydranty, zbiorniki, wydajność) – opis", "type": "textarea"},
-        {"name": "sprinkler", "label": "Instalacja tryskaczowa – status", "type": "select", "options": _sprinkler()},
-        {"name": "fire_load", "label": "Obciążenie ogniowe Q(MJ/m²)", "type": "select", "options": _fire_load()},
-        {"name": "stored_materials", "label": "Rodzaj magazynowanego materiału + ilości + sposób składowania (opis)", "type": "textarea"},
-        {"name": "fire_zones", "label": "Podział na strefy pożarowe (jeśli narzucony) – opis", "type": "textarea"},
-        {"name": "smoke_exhaust", "label": "Oddymianie / klapy dymowe / pasma – wymagania (opis)", "type": "textarea"},
-        {"name": "fire_alarm", "label": "SSP/DSO/monitoring pożarowy – wymagania inwestora (opis)", "type": "textarea"},
-        {"name": "fire_consultant", "label": "Czy inwestor ma rzeczoznawcę ppoż / standard korporacyjny? (opis)", "type": "textarea"},
-    ]),
-
-    ("O. BHP / ergonomia / ryzyka operacyjne", [
-        {"name": "hse_risks", "label": "Ryzyka BHP (chemia, hałas, pyły, ruch pojazdów) – opis", "type": "textarea"},
-        {"name": "ppe_zones", "label": "Strefy wymagające ŚOI / procedury wejścia – opis", "type": "textarea"},
-        {"name": "emergency_procedures", "label": "Procedury awaryjne (ewakuacja, wycieki, awaria zasilania) – opis", "type": "textarea"},
-        {"name": "safety_barriers", "label": "Wymagania barier/odbojów/siatek/kurtyn – opis", "type": "textarea"},
-        {"name": "cleanliness", "label": "Wymagania czystości (brudna/czysta, śluzy, strefowanie) – opis", "type": "textarea"},
-    ]),
-
-    ("P. Zatrudnienie, zmiany, socjal", [
-        {"name": "shifts", "label": "Tryb pracy", "type": "select", "options": _shifts()},
-        {"name": "workers_total", "label": "Liczba pracowników (łącznie) – szacunek", "type": "number", "min": 0},
-        {"name": "workers_per_shift", "label": "Liczba pracowników na zmianie – szacunek", "type": "number", "min": 0},
-        {"name": "office_staff", "label": "Liczba pracowników biurowych – szacunek", "type": "number", "min": 0},
-        {"name": "gender_split", "label": "Struktura (opcjonalnie): kobiety/mężczyźni (dla szatni/sanitariatów) – opis", "type": "textarea"},
-        {"name": "social_requirements", "label": "Zaplecze socjalne (szatnie czysta/brudna, prysznice, jadalnia) – opis", "type": "textarea"},
-        {"name": "office_standard", "label": "Standard części biurowej", "type": "select", "options": _office_standard()},
-        {"name": "visitor_flow", "label": "Ruch gości / recepcja / strefy reprezentacyjne – opis", "type": "textarea"},
-    ]),
-
-    ("Q. IT / bezpieczeństwo / ochrona", [
-        {"name": "security_level", "label": "Poziom zabezpieczeń", "type": "select", "options": _security_level()},
-        {"name": "cctv", "label": "CCTV – zakres (strefy, retencja nagrań) – opis", "type": "textarea"},
-        {"name": "access_control", "label": "Kontrola dostępu (KD) – zakres (strefy, uprawnienia) – opis", "type": "textarea"},
-        {"name": "intrusion", "label": "SSWiN / ochrona fizyczna – opis", "type": "textarea"},
-        {"name": "it_rooms", "label": "Serwerownia / teletechnika – wymagania (klima, UPS, redundancja) – opis", "type": "textarea"},
-        {"name": "network_requirements", "label": "Sieć (Wi-Fi przemysłowe, IoT, OT/SCADA) – opis", "type": "textarea"},
-    ]),
-
-    ("R. Standardy, audyty, wymagania korporacyjne", [
-        {"name": "audit_standards", "label": "Standardy / audyty (wybierz)", "type": "select", "options": _audit_standards()},
-        {"name": "audit_notes", "label": "Wymagania audytowe i korporacyjne (materiały, procedury, układ) – opis", "type": "textarea"},
-        {"name": "bim_requirement", "label": "BIM", "type": "select", "options": _bim()},
-        {"name": "design_guidelines", "label": "Wytyczne inwestora (brandbook, standard obiektów) – opis", "type": "textarea"},
-    ]),
-
-    ("S. Zewnętrzne zagospodarowanie terenu", [
-        {"name": "parking_policy", "label": "Parkingi – założenia", "type": "select", "options": _parking_req()},
-        {"name": "parking_counts", "label": "Liczba miejsc: osobowe / ciężarowe / rowery (jeśli znane) – opis", "type": "textarea"},
-        {"name": "roads_internal", "label": "Drogi wewnętrzne, place, nawierzchnie – wymagania (opis)", "type": "textarea"},
-        {"name": "fence", "label": "Ogrodzenie – czy wymagane?", "type": "select", "options": ["Tak", "Nie", "Nie wiem"]},
-        {"name": "gatehouse", "label": "Portiernia / wjazd kontrolowany – wymagania (opis)", "type": "textarea"},
-        {"name": "stormwater_retention", "label": "Retencja / zbiorniki / zrzut deszczówki – wymagania (opis)", "type": "textarea"},
-        {"name": "external_storage", "label": "Składowanie zewnętrzne (kontenery, odpady, palety) – opis", "type": "textarea"},
-        {"name": "waste_management", "label": "Gospodarka odpadami (rodzaje, ilości, lokalizacja, segregacja) – opis", "type": "textarea"},
-    ]),
-
-    ("T. Budżet, harmonogram, ryzyka", [
-        {"name": "budget_total", "label": "Budżet całej inwestycji [PLN] (jeśli jest)", "type": "number", "min": 0},
-        {"name": "budget_build_only", "label": "Budżet budowy (bez gruntu) [PLN] (jeśli jest)", "type": "number", "min": 0},
-        {"name": "timeline_start", "label": "Planowany start prac (projekt/budowa) – opis", "type": "textarea"},
-        {"name": "timeline_deadline", "label": "Termin oddania / uruchomienia (czy jest krytyczny?) – opis", "type": "textarea"},
-        {"name": "priority", "label": "Priorytet projektu", "type": "select", "options": _priority()},
-        {"name": "risk_register", "label": "Ryzyka zidentyfikowane przez inwestora (formalno-prawne, techniczne, operacyjne) – opis", "type": "textarea"},
-        {"name": "no_go", "label": "Warunki 'no-go' (czego nie wolno przekroczyć) – opis", "type": "textarea"},
-        {"name": "unknowns", "label": "Obszary nieustalone (co wymaga doprecyzowania) – opis", "type": "textarea"},
-        {"name": "must_have", "label": "Must-have (wymagania bezwzględne) – opis", "type": "textarea"},
-        {"name": "nice_to_have", "label": "Nice-to-have (mile widziane) – opis", "type": "textarea"},
-        {"name": "dont_want", "label": "Czego na pewno nie chcesz – opis", "type": "textarea"},
-    ]),
-
-    ("U. Załączniki (opcjonalnie)", [
-        {"name": "attachments", "label": "Pliki (MPZP/WZ, mapa, geotechnika, warunki przyłączy, proces/technologia, szkice)", "type": "file", "multiple": True},
-    ]),
-]
+# Płaska lista (name, label, tytuł sekcji) w kolejności schematu – jedna pętla w _form_to_rows
+@functools.lru_cache(maxsize=None)
+def _schema_flat() -> Tuple[Tuple[str, str, str], ...]:
+    return tuple(
+        (name, label or name, title)
+        for title, sec in form_schema_soa()
+        for name, label in zip(sec.names, sec.labels)
+        if name
+    )
 
 
 # =========================
 # 3) Prosta baza danych (JSON)
 # =========================
 
-def _load_db() -> Dict[str, Any]:
-    if not os.path.exists(DATA_FILE):
-        return {"companies": {}}
+# Cache bazy w procesie: plik czytamy ponownie tylko gdy zmienił się jego stat (mtime_ns + rozmiar),
+# np. po zapisie z innego workera. Handlery dostają współdzielony dict: każda ścieżka, która go zmienia,
+# kończy się _save_db (inaczej zmiana wycieka do innych żądań i zapisze się przy cudzym zapisie);
+# ścieżki tylko do odczytu niczego w nim nie poprawiają.
+_DB_LOCK = threading.Lock()
+_DB_CACHE: Dict[str, Any] = {"data": None, "stamp": None, "dirty": False, "dirty_cids": set(), "timer": None, "migrate": False, "shards": {}}
+
+def _file_stamp(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _db_stamp() -> Optional[Tuple[int, int]]:
+    return _file_stamp(DATA_FILE)
+
+def _json_loads(raw: "bytes | str") -> Any:
+    return orjson.loads(raw) if orjson is not None else json.loads(raw)
+
+def _json_bytes(obj: Any) -> bytes:
+    """Kompaktowy JSON od razu jako bajty UTF-8 (orjson zwraca bytes – bez osobnego .encode())."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _json_text(obj: Any) -> str:
+    """Kompaktowy JSON jako str (UTF-8, bez escapowania polskich znaków) – np. payload do OpenAI."""
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+def _json_dumps(obj: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2) if DB_PRETTY_JSON else orjson.dumps(obj)
+    if DB_PRETTY_JSON:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8")
+    return _json_bytes(obj)
+
+def _write_file_atomic(path: str, raw: bytes) -> None:
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(raw)
+    os.replace(tmp, path)
+
+def _shard_path(cid: str) -> str:
+    return os.path.join(DB_SHARD_DIR, f"{cid}.json")
+
+def _read_db_file() -> Dict[str, Any]:
+    with open(DATA_FILE, "rb") as f:
+        db = _json_loads(f.read())
+    # Indeks shardów: firmy doczytujemy z osobnych plików. Stary data.json (z "companies") czytamy wprost,
+    # a pierwszy zapis rozkłada go na shardy.
+    _DB_CACHE["migrate"] = bool(DB_SHARD_DIR and "companies" in db)
+    if DB_SHARD_DIR and "companies" not in db:
+        # Shard czytamy ponownie tylko gdy zmienił się jego stat – zapis innego workera dotyka zwykle
+        # jednej firmy, więc przeładowanie kosztuje indeks + jeden plik, a nie wszystkie firmy
+        shards = _DB_CACHE["shards"]
+        fresh: Dict[str, Tuple[Optional[Tuple[int, int]], Dict[str, Any]]] = {}
+        companies: Dict[str, Any] = {}
+        for cid in db.pop("company_ids", []):
+            path = _shard_path(cid)
+            stamp = _file_stamp(path)
+            hit = shards.get(cid)
+            if hit is not None and stamp is not None and hit[0] == stamp:
+                companies[cid] = hit[1]
+            else:
+                with open(path, "rb") as f:
+                    companies[cid] = _json_loads(f.read())
+            fresh[cid] = (stamp, companies[cid])
+        _DB_CACHE["shards"] = fresh
+        db["companies"] = companies
+    return db
+
+def _disk_company_ids() -> List[str]:
+    """company_ids z indeksu na dysku (stary jednoplikowy data.json: klucze "companies")."""
     try:
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+        with open(DATA_FILE, "rb") as f:
+            disk = _json_loads(f.read())
     except Exception:
-        return {"companies": {}}
+        return []
+    ids = disk.get("company_ids") if isinstance(disk, dict) else None
+    if isinstance(ids, list):
+        return [str(cid) for cid in ids]
+    return list(disk.get("companies") or {}) if isinstance(disk, dict) else []
 
-def _save_db(db: Dict[str, Any]) -> None:
-    tmp = DATA_FILE + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(db, f, ensure_ascii=False, indent=2)
-    os.replace(tmp, DATA_FILE)
+def _load_db() -> Dict[str, Any]:
+    with _DB_LOCK:
+        # Niezapisane jeszcze zmiany mają pierwszeństwo przed plikiem; jeśli w międzyczasie plik zmienił
+        # inny worker, zapisujemy od razu (z dołączeniem jego zmian – patrz _write_db_locked)
+        if _DB_CACHE["dirty"]:
+            if _db_stamp() != _DB_CACHE["stamp"]:
+                try:
+                    _write_db_locked(_DB_CACHE["data"], _DB_CACHE["dirty_cids"])
+                except Exception as e:
+                    log.error("[DB] flush failed file=%s err=%s: %s", DATA_FILE, type(e).__name__, e)
+            return _DB_CACHE["data"]
+        stamp = _db_stamp()
+        if _DB_CACHE["data"] is not None and _DB_CACHE["stamp"] == stamp:
+            return _DB_CACHE["data"]
+        # Pusta baza też trafia do cache – dwie równoległe pierwsze rejestracje dostają ten sam dict
+        if stamp is None:
+            db = {"companies": {}}
+        else:
+            try:
+                db = _read_db_file()
+            except Exception as e:
+                # Pusta baza pod stampem None: następny _load_db spróbuje odczytu ponownie, a _write_db_locked
+                # przy niezgodnym stampie najpierw czyta plik – nieczytelnego pliku nie nadpisze
+                log.error("[DB] read failed file=%s err=%s: %s", DATA_FILE, type(e).__name__, e)
+                db = {"companies": {}}
+                stamp = None
+        _DB_CACHE["data"] = db
+        _DB_CACHE["stamp"] = stamp
+        return db
+
+def _merge_db(disk: Dict[str, Any], db: Dict[str, Any], cids: Optional[set]) -> Dict[str, Any]:
+    """Nasze zmiany nałożone na świeżo odczytany plik: zmienione firmy (`cids`, None = wszystkie nasze)
+    zastępują wersję z dysku, pozostałe firmy zostają z dysku; słowniki najwyższego poziomu
+    (np. submit_tokens) są łączone."""
+    companies = disk.setdefault("companies", {})
+    ours = db.get("companies", {})
+    for cid in (ours if cids is None else cids):
+        if cid in ours:
+            companies[cid] = ours[cid]
+        else:
+            companies.pop(cid, None)
+    for k, v in db.items():
+        if k == "companies":
+            continue
+        if isinstance(v, dict) and isinstance(disk.get(k), dict):
+            disk[k].update(v)
+        else:
+            disk[k] = v
+    return disk
+
+def _drop_indexes_locked() -> None:
+    """Po _merge_db firmy w dict mogły się podmienić – _token_index/_email_index zbudują się od nowa."""
+    _DB_CACHE["tokens"] = None
+    _DB_CACHE["emails"] = None
+
+def _write_db_locked(db: Dict[str, Any], cids: Optional[set] = None) -> None:
+    """Atomowy zapis (tmp + os.replace). Wywoływać z trzymanym _DB_LOCK.
+    W trybie shardów `cids` ogranicza zapis do zmienionych firm (None = wszystkie).
+    Zapisujemy wynik _merge_db, a nie sam `db`, gdy:
+    - plik zmienił się od ostatniego odczytu (zapis z innego workera) – bazą jest świeżo odczytany plik;
+    - `db` nie jest już obiektem z cache (inne żądanie w tym workerze przeładowało bazę po naszym odczycie,
+      więc `db` jest starszy niż plik) – bazą jest aktualny dict z cache."""
+    stamp = _db_stamp()
+    cached = _DB_CACHE["data"]
+    if stamp != _DB_CACHE["stamp"]:
+        if stamp is not None:
+            db = _merge_db(_read_db_file(), db, cids)
+            _drop_indexes_locked()
+    elif cached is not None and db is not cached:
+        db = _merge_db(cached, db, cids)
+        _drop_indexes_locked()
+    missing = False
+    if not DB_SHARD_DIR:
+        _write_file_atomic(DATA_FILE, _json_dumps(db))
+    else:
+        companies = db.get("companies", {})
+        os.makedirs(DB_SHARD_DIR, exist_ok=True)
+        shards = _DB_CACHE["shards"]
+        removed = set()
+        for cid in (companies if cids is None else cids):
+            if cid in companies:
+                path = _shard_path(cid)
+                _write_file_atomic(path, _json_dumps(companies[cid]))
+                shards[cid] = (_file_stamp(path), companies[cid])
+            else:
+                removed.add(cid)
+                shards.pop(cid, None)
+                try:
+                    os.remove(_shard_path(cid))
+                except OSError:
+                    pass
+        # Lista firm w indeksie = to, co jest na dysku, plus nasze firmy, minus usunięte – a nie samo
+        # `companies` z pamięci, które może nie znać firmy zarejestrowanej przez inny worker
+        disk_ids = [cid for cid in _disk_company_ids() if cid not in removed]
+        known = set(disk_ids)
+        company_ids = disk_ids + [cid for cid in companies if cid not in known]
+        index = {k: v for k, v in db.items() if k != "companies"}
+        index["company_ids"] = company_ids
+        _write_file_atomic(DATA_FILE, _json_dumps(index))
+        missing = len(company_ids) != len(companies)
+    _DB_CACHE["data"] = db
+    # Firmy z indeksu, których nie mamy w pamięci: pusty stamp wymusza przeładowanie przy następnym _load_db
+    _DB_CACHE["stamp"] = None if missing else _db_stamp()
+    _DB_CACHE["dirty"] = False
+    _DB_CACHE["dirty_cids"] = set()
+    _DB_CACHE["migrate"] = False
+
+# Po nieudanym zapisie z timera próbujemy ponownie po tym czasie (zmiany zostają w cache jako dirty)
+_DB_FLUSH_RETRY_S = 1.0
+
+def _schedule_flush_locked(delay_s: float) -> None:
+    if _DB_CACHE["timer"] is None:
+        t = threading.Timer(delay_s, _flush_db)
+        t.daemon = True
+        _DB_CACHE["timer"] = t
+        t.start()
+
+def _flush_db(retry: bool = True) -> None:
+    with _DB_LOCK:
+        _DB_CACHE["timer"] = None
+        if _DB_CACHE["dirty"] and _DB_CACHE["data"] is not None:
+            try:
+                _write_db_locked(_DB_CACHE["data"], _DB_CACHE["dirty_cids"])
+            except Exception as e:
+                log.error("[DB] flush failed file=%s retry=%s err=%s: %s", DATA_FILE, retry, type(e).__name__, e)
+                if retry:
+                    _schedule_flush_locked(_DB_FLUSH_RETRY_S)
+
+def _save_db(db: Dict[str, Any], company_id: Optional[str] = None) -> None:
+    """Zapis bazy. `company_id` = jedyna zmieniona firma (w trybie shardów zapisujemy tylko jej plik);
+    bez niego zapisujemy wszystko."""
+    with _DB_LOCK:
+        cids = _DB_CACHE["dirty_cids"] if _DB_CACHE["dirty"] else set()
+        if cids is not None:
+            cids = None if (company_id is None or _DB_CACHE["migrate"]) else cids | {company_id}
+        if DB_SAVE_DELAY_MS <= 0:
+            _write_db_locked(db, cids)
+            return
+        # Handler trzyma dict sprzed przeładowania cache – jego firmę nakładamy na aktualny dict (z innymi
+        # niezapisanymi zmianami), zamiast podmieniać cały cache starszą wersją
+        cached = _DB_CACHE["data"]
+        if cached is not None and db is not cached:
+            db = _merge_db(cached, db, None if company_id is None else {company_id})
+            _drop_indexes_locked()
+        _DB_CACHE["data"] = db
+        _DB_CACHE["dirty"] = True
+        _DB_CACHE["dirty_cids"] = cids
+        _schedule_flush_locked(DB_SAVE_DELAY_MS / 1000.0)
+
+async def _load_db_async() -> Dict[str, Any]:
+    """_load_db dla handlerów async – ewentualne czekanie na _DB_LOCK (trwający zapis) i ponowny odczyt pliku
+    po zapisie z innego workera odbywają się w puli wątków."""
+    return await run_in_threadpool(_load_db)
+
+async def _save_db_async(db: Dict[str, Any], company_id: Optional[str] = None) -> None:
+    """_save_db dla handlerów async – zapis (i czekanie na _DB_LOCK) w puli wątków, nie w pętli zdarzeń."""
+    await run_in_threadpool(_save_db, db, company_id)
+
+# Przy zamknięciu procesu nie gubimy zapisu czekającego na timer
+atexit.register(_flush_db, retry=False)
+
+def _token_index(db: Dict[str, Any]) -> Dict[str, Tuple[str, str]]:
+    """Indeks token formularza -> (company_id, architect_id). Budowany leniwie dla danego obiektu bazy
+    (po przeładowaniu pliku powstaje nowy); add/delete architekta aktualizują go na bieżąco. Nie trafia do JSON."""
+    with _DB_LOCK:
+        idx = _DB_CACHE.get("tokens")
+        if idx is None or _DB_CACHE.get("tokens_db") is not db:
+            idx = {}
+            for cid, c in db.get("companies", {}).items():
+                for a in c.get("architects") or []:
+                    tok = a.get("token")
+                    if tok:
+                        idx[tok] = (cid, a.get("id"))
+            _DB_CACHE["tokens"] = idx
+            _DB_CACHE["tokens_db"] = db
+        return idx
+
+def _email_index(db: Dict[str, Any]) -> Dict[str, str]:
+    """Indeks email firmy -> company_id (logowanie/rejestracja bez przeglądania wszystkich firm).
+    Budowany leniwie dla danego obiektu bazy, jak _token_index; rejestracja dopisuje nową firmę. Nie trafia do JSON."""
+    with _DB_LOCK:
+        idx = _DB_CACHE.get("emails")
+        if idx is None or _DB_CACHE.get("emails_db") is not db:
+            idx = {}
+            for cid, c in db.get("companies", {}).items():
+                email = c.get("email")
+                if email:
+                    idx.setdefault(email, cid)
+            _DB_CACHE["emails"] = idx
+            _DB_CACHE["emails_db"] = db
+        return idx
 
 def _now_ts() -> int:
     return int(time.time())
@@ -689,32 +1003,54 @@ def _forms_limit(company: dict) -> int:
         return FORMS_PER_MONTH_LIMIT
     return 0
 
-def _period_key(ts: Optional[int] = None) -> str:
-    dt = datetime.datetime.utcfromtimestamp(ts or _now_ts())
-    return f"{dt.year:04d}-{dt.month:02d}"
+# Ostatnio policzony okres (minuta, "RRRR-MM") – w obrębie minuty klucz się nie zmienia.
+# Jedna krotka podmieniana w całości, więc odczyt z wielu wątków jest spójny.
+_PERIOD_KEY_CACHE: List[Tuple[int, str]] = [(-1, "")]
 
-def _ensure_usage_period(company: Dict[str, Any]) -> None:
+def _period_key(ts: Optional[int] = None) -> str:
+    t = ts or _now_ts()
+    minute = t // 60
+    cached = _PERIOD_KEY_CACHE[0]
+    if cached[0] == minute:
+        return cached[1]
+    y, m = time.gmtime(t)[:2]
+    key = f"{y:04d}-{m:02d}"
+    _PERIOD_KEY_CACHE[0] = (minute, key)
+    return key
+
+def _ensure_usage_period(company: Dict[str, Any]) -> Dict[str, Any]:
+    """Zwraca company["usage"] dla bieżącego miesiąca (nowy okres = licznik od zera).
+    Starsze rekordy z bieżącym okresem mogą nie mieć forms_sent – czytać przez .get()."""
     usage = company.get("usage") or {}
     pk = _period_key()
     if usage.get("period") != pk:
         usage = {"period": pk, "forms_sent": 0}
         company["usage"] = usage
+    return usage
+
+def _forms_sent(company: Dict[str, Any]) -> int:
+    """Formularze wysłane w bieżącym miesiącu – bez modyfikacji rekordu (ścieżki tylko do odczytu)."""
+    usage = company.get("usage") or {}
+    if usage.get("period") != _period_key():
+        return 0
+    return int(usage.get("forms_sent") or 0)
 
 def _forms_remaining(company: Dict[str, Any]) -> int:
-    _ensure_usage_period(company)
-    sent = int((company.get("usage") or {}).get("forms_sent") or 0)
-    limit = _forms_limit(company)
-    return max(0, limit - sent)
+    return max(0, _forms_limit(company) - _forms_sent(company))
 
 def _increment_forms_sent(db: Dict[str, Any], company_id: str) -> None:
-    c = db["companies"][company_id]
-    _ensure_usage_period(c)
-    c["usage"]["forms_sent"] = int(c["usage"].get("forms_sent") or 0) + 1
+    usage = _ensure_usage_period(db["companies"][company_id])
+    usage["forms_sent"] = int(usage.get("forms_sent", 0) or 0) + 1
 
 def _ensure_reports(company: Dict[str, Any]) -> None:
     if "reports" not in company or not isinstance(company.get("reports"), list):
         company["reports"] = []
 
+def _company_reports(company: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Historia raportów do odczytu (bez poprawiania rekordu jak _ensure_reports)."""
+    reports = company.get("reports")
+    return reports if isinstance(reports, list) else []
+
 def _pick_title_from_form(form_clean: Dict[str, Any]) -> str:
     # Próbujemy znaleźć sensowny tytuł bez zależności od konkretnego schematu pól
     keys = [
@@ -764,39 +1100,84 @@ def _store_report(
     return rid
 
 
+# Losowe tokeny z puli: jeden odczyt os.urandom na 64 tokeny zamiast syscalla na każdy.
+# Format identyczny z secrets.token_urlsafe(n).
+_TOKEN_BATCH = 64
+_TOKEN_POOLS: Dict[int, "deque[str]"] = {}
+_TOKEN_LOCK = threading.Lock()
+
+def _new_token(nbytes: int = 16) -> str:
+    with _TOKEN_LOCK:
+        pool = _TOKEN_POOLS.setdefault(nbytes, deque())
+        if not pool:
+            buf = os.urandom(nbytes * _TOKEN_BATCH)
+            pool.extend(
+                base64.urlsafe_b64encode(buf[i:i + nbytes]).rstrip(b"=").decode("ascii")
+                for i in range(0, len(buf), nbytes)
+            )
+        return pool.popleft()
+
+def _reset_token_pools() -> None:
+    """Po fork (np. gunicorn --preload) dziecko zaczyna z pustą pulą – inaczej workery wydawałyby te same tokeny."""
+    global _TOKEN_LOCK
+    _TOKEN_LOCK = threading.Lock()
+    _TOKEN_POOLS.clear()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_token_pools)
+
 def _new_submit_token() -> str:
-    return secrets.token_urlsafe(16)
+    return _new_token(16)
 
 def _mark_submit_token_used(db: Dict[str, Any], token: str, ttl_seconds: int = 6 * 60 * 60) -> bool:
-    meta = db.setdefault("submit_tokens", {})
     now = _now_ts()
+    # Duplikat nie zmienia bazy – ta ścieżka kończy się bez zapisu
+    seen = (db.get("submit_tokens") or {}).get(token)
+    if seen is not None:
+        try:
+            if now - int(seen) <= ttl_seconds:
+                return True
+        except Exception:
+            pass
+    meta = db.setdefault("submit_tokens", {})
+    # Tokeny są dopisywane w kolejności czasu (dict i JSON zachowują kolejność) – wygasłe leżą na początku,
+    # więc skanujemy tylko do pierwszego ważnego zamiast po całym słowniku
+    expired = []
     try:
-        for k, ts in list(meta.items()):
-            if now - int(ts) > ttl_seconds:
-                meta.pop(k, None)
+        for k, ts in meta.items():
+            if now - int(ts) <= ttl_seconds:
+                break
+            expired.append(k)
     except Exception:
         pass
+    for k in expired:
+        meta.pop(k, None)
 
     if token in meta:
         return True
     meta[token] = now
     return False
 
+_PBKDF2_HASH = "sha256"
+_PBKDF2_ITERATIONS = 120_000
+
+def _pbkdf2(password: str, salt: bytes) -> bytes:
+    return hashlib.pbkdf2_hmac(_PBKDF2_HASH, password.encode("utf-8"), salt, _PBKDF2_ITERATIONS)
+
 def _hash_password(password: str, salt_b64: Optional[str] = None) -> str:
     salt = base64.b64decode(salt_b64) if salt_b64 else secrets.token_bytes(16)
-    dk = hashlib.pbkdf2_hmac("sha256", password.encode("utf-8"), salt, 120_000)
-    return base64.b64encode(salt).decode() + "$" + base64.b64encode(dk).decode()
+    return base64.b64encode(salt).decode() + "$" + base64.b64encode(_pbkdf2(password, salt)).decode()
 
 def _verify_password(password: str, stored: str) -> bool:
+    # Liczymy klucz wprost z zapisanej soli i porównujemy bajty (bez składania i dzielenia stringu jak w _hash_password)
     try:
         salt_b64, dk_b64 = stored.split("$", 1)
-        check = _hash_password(password, salt_b64=salt_b64).split("$", 1)[1]
-        return hmac.compare_digest(check, dk_b64)
+        return hmac.compare_digest(_pbkdf2(password, base64.b64decode(salt_b64)), base64.b64decode(dk_b64))
     except Exception:
         return False
 
 def _new_id(prefix: str) -> str:
-    return f"{prefix}_{secrets.token_urlsafe(8)}"
+    return f"{prefix}_{_new_token(8)}"
 
 def _clean_value(v: Any) -> Any:
     if v is None:
@@ -807,12 +1188,16 @@ def _clean_value(v: Any) -> Any:
     return v
 
 def _clean_form_dict(d: Dict[str, Any]) -> Dict[str, Any]:
+    # Ta sama logika co _clean_value, ale bez wywołania funkcji na każde pole
     out: Dict[str, Any] = {}
     for k, v in d.items():
-        v2 = _clean_value(v)
-        if v2 is None:
+        if type(v) is str:  # wartości z formularza to zwykłe str – dokładne porównanie typu zamiast isinstance
+            v = v.strip()
+            if not v:
+                continue
+        elif v is None:
             continue
-        out[k] = v2
+        out[k] = v
     return out
 
 
@@ -820,17 +1205,21 @@ def _clean_form_dict(d: Dict[str, Any]) -> Dict[str, Any]:
 # 4) UI helpers
 # =========================
 
+# Jedno przejście str.translate zamiast kilku replace() w html.escape – wynik identyczny
+_HTML_ESC_TABLE = str.maketrans({"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;", "'": "&#x27;"})
+
 def esc(s: Any) -> str:
-    return html.escape("" if s is None else str(s), quote=True)
+    return "" if s is None else str(s).translate(_HTML_ESC_TABLE)
+
+# Stałe wstawiane do każdej strony – escapowane raz przy imporcie
+_ESC_APP_NAME = esc(APP_NAME)
 
 def badge(label: str, ok: bool) -> str:
     cls = "badge ok" if ok else "badge bad"
     return f'<span class="{cls}">{esc(label)}</span>'
 
-def layout(title: str, body: str, *, nav: str = "", request: Optional[Request] = None, page: str = "") -> str:
-    """Globalny layout UI (jeden plik). Kolory pozostają zgodne z ikoną / tłem.
-    `page` pozwala dodać lekkie różnice (np. home ma splash).
-    """
+def _layout_head(title: str, *, nav: str = "", request: Optional[Request] = None, page: str = "") -> str:
+    """Część layoutu przed `body` (head, style, topbar) – jedyna z wartościami dynamicznymi."""
     logged_in = False
     company_name = ""
     if request is not None:
@@ -863,7 +1252,7 @@ def layout(title: str, body: str, *, nav: str = "", request: Optional[Request] =
 <head>
   <meta charset="utf-8"/>
   <meta name="viewport" content="width=device-width, initial-scale=1"/>
-  <title>{esc(title)} • {APP_NAME}</title>
+  <title>{esc(title)} • {_ESC_APP_NAME}</title>
   <link rel="icon" href="/logo_arch.png" type="image/png"/>
   <link rel="preconnect" href="https://fonts.googleapis.com">
   <link rel="preconnect" href="https://fonts.gstatic.com" crossorigin>
@@ -1222,7 +1611,7 @@ def layout(title: str, body: str, *, nav: str = "", request: Optional[Request] =
         <div class="brand">
           <div class="logo"></div>
           <div style="display:flex;flex-direction:column;line-height:1">
-            <div style="font-weight:950">{esc(APP_NAME)}</div>
+            <div style="font-weight:950">{_ESC_APP_NAME}</div>
             <div style="font-size:12px;color:rgba(238,242,255,0.55);font-weight:850">{esc(company_name) if company_name else "Brief → Raport → Wycena"}</div>
           </div>
         </div>
@@ -1231,26 +1620,30 @@ def layout(title: str, body: str, *, nav: str = "", request: Optional[Request] =
       </div>
     </div>
   </div>
-  {body}
+  """
+
+
+# Stopka layoutu nie zależy od strony – trzymamy ją raz (str i gotowe bajty do streamingu)
+_LAYOUT_TAIL = """
 <script>
-(() => {{
+(() => {
   // Reveal on scroll
   const els = Array.from(document.querySelectorAll('[data-reveal]'));
   const reduce = window.matchMedia && window.matchMedia('(prefers-reduced-motion: reduce)').matches;
-  if (els.length) {{
-    if (reduce || !('IntersectionObserver' in window)) {{ els.forEach(el => el.classList.add('in')); }}
-    else {{
-      const io = new IntersectionObserver((entries) => {{
-        for (const e of entries) {{
-          if (e.isIntersecting) {{ e.target.classList.add('in'); io.unobserve(e.target); }}
-        }}
-      }}, {{ threshold: 0.12 }});
-      els.forEach(el => {{ el.classList.add('reveal'); io.observe(el); }});
-    }}
-  }}
+  if (els.length) {
+    if (reduce || !('IntersectionObserver' in window)) { els.forEach(el => el.classList.add('in')); }
+    else {
+      const io = new IntersectionObserver((entries) => {
+        for (const e of entries) {
+          if (e.isIntersecting) { e.target.classList.add('in'); io.unobserve(e.target); }
+        }
+      }, { threshold: 0.12 });
+      els.forEach(el => { el.classList.add('reveal'); io.observe(el); });
+    }
+  }
 
   // Copy helpers
-  document.addEventListener('click', async (ev) => {{
+  document.addEventListener('click', async (ev) => {
     const t = ev.target;
     if (!(t instanceof HTMLElement)) return;
     const btn = t.closest('[data-copy],[data-copy-text]');
@@ -1258,51 +1651,51 @@ def layout(title: str, body: str, *, nav: str = "", request: Optional[Request] =
     const sel = btn.getAttribute('data-copy');
     const el = sel ? document.querySelector(sel) : null;
     const txt = el ? (el.textContent || '') : (btn.getAttribute('data-copy-text') || '');
-    try {{
+    try {
       await navigator.clipboard.writeText(txt.trim());
       const old = btn.textContent || '';
       btn.textContent = 'Skopiowano';
       setTimeout(() => btn.textContent = old || 'Kopiuj', 1200);
-    }} catch(e) {{
+    } catch(e) {
       alert('Nie udało się skopiować. Zaznacz tekst i skopiuj ręcznie.');
-    }}
-  }});
+    }
+  });
 
   // Home: splash once per session
   const splash = document.getElementById('splash');
-  if (splash) {{
+  if (splash) {
     const key = 'ab_splash_once_v1';
     const already = sessionStorage.getItem(key);
-    const hide = () => {{
+    const hide = () => {
       if (splash.classList.contains('hide')) return;
       document.body.classList.remove('no-scroll');
       splash.classList.add('hide');
       setTimeout(() => splash.remove(), 920);
-    }};
-    if (already) {{
+    };
+    if (already) {
       splash.remove();
-    }} else {{
+    } else {
       document.body.classList.add('no-scroll');
       sessionStorage.setItem(key, '1');
       setTimeout(hide, 2200);
-      window.addEventListener('wheel', hide, {{ passive:true, once:true }});
-      window.addEventListener('touchstart', hide, {{ passive:true, once:true }});
-      splash.addEventListener('click', hide, {{ once:true }});
-    }}
-  }}
+      window.addEventListener('wheel', hide, { passive:true, once:true });
+      window.addEventListener('touchstart', hide, { passive:true, once:true });
+      splash.addEventListener('click', hide, { once:true });
+    }
+  }
 
   // Home: scroll slides
   const shell = document.getElementById('howShell');
-  if (shell) {{
+  if (shell) {
     const frames = Array.from(document.querySelectorAll('.scene .frame'));
     const items = Array.from(document.querySelectorAll('.stepList .item'));
     const n = Math.max(frames.length, items.length);
-    function setActive(i) {{
+    function setActive(i) {
       frames.forEach((f, idx) => f.classList.toggle('show', idx===i));
       items.forEach((it, idx) => it.classList.toggle('active', idx===i));
-    }}
-    function clamp(v, a, b) {{ return Math.max(a, Math.min(b, v)); }}
-    function onScroll() {{
+    }
+    function clamp(v, a, b) { return Math.max(a, Math.min(b, v)); }
+    function onScroll() {
       const rect = shell.getBoundingClientRect();
       const vh = window.innerHeight || 800;
       const total = rect.height - vh;
@@ -1310,27 +1703,34 @@ def layout(title: str, body: str, *, nav: str = "", request: Optional[Request] =
       const p = total > 0 ? y / total : 0;
       const idx = clamp(Math.floor(p * n), 0, n-1);
       setActive(idx);
-    }}
-    items.forEach((it, idx) => {{
-      it.addEventListener('click', () => {{
+    }
+    items.forEach((it, idx) => {
+      it.addEventListener('click', () => {
         const rect = shell.getBoundingClientRect();
         const top = window.scrollY + rect.top;
         const target = top + (idx / n) * (rect.height - (window.innerHeight||800));
-        window.scrollTo({{ top: target, behavior: 'smooth' }});
-      }});
-    }});
-    window.addEventListener('scroll', onScroll, {{ passive:true }});
+        window.scrollTo({ top: target, behavior: 'smooth' });
+      });
+    });
+    window.addEventListener('scroll', onScroll, { passive:true });
     window.addEventListener('resize', onScroll);
     setTimeout(onScroll, 0);
-  }}
-}})();
+  }
+})();
 </script>
 </body>
 </html>
 """
 
-def nav_links() -> str:
-    return """
+
+def layout(title: str, body: str, *, nav: str = "", request: Optional[Request] = None, page: str = "") -> str:
+    """Globalny layout UI (jeden plik). Kolory pozostają zgodne z ikoną / tłem.
+    `page` pozwala dodać lekkie różnice (np. home ma splash).
+    """
+    return "".join((_layout_head(title, nav=nav, request=request, page=page), body, _LAYOUT_TAIL))
+
+# Menu publicznych stron nie zależy od requestu – jedna stała
+_NAV_LINKS = """
       <a href="/#jak">Jak działa</a>
       <a href="/#funkcje">Funkcje</a>
       <a href="/#raport">Raport</a>
@@ -1338,25 +1738,30 @@ def nav_links() -> str:
       <a href="/#faq">FAQ</a>
     """
 
+def nav_links() -> str:
+    return _NAV_LINKS
+
 
 
 # =========================
 # 5) Render formularza
 # =========================
 
-def render_form(action_url: str, *, title: str, subtitle: str, submit_token: Optional[str] = None) -> str:
+@functools.lru_cache(maxsize=1)
+def _form_blocks_html() -> str:
+    """Sekcje formularza z FORM_SCHEMA – stałe, więc renderowane raz."""
     blocks = []
-    for sec_title, fields in FORM_SCHEMA:
+    for sec_title, fields in FORM_SCHEMA.items():
         inner = []
         for f in fields:
-            ftype = f["type"]
-            name = f["name"]
-            label = f["label"]
-            ph = f.get("ph", "")
-            multiple = bool(f.get("multiple", False))
-            opts = f.get("options", [])
-            minv = f.get("min")
-            maxv = f.get("max")
+            ftype = f.type
+            name = f.name
+            label = f.label
+            ph = f.ph
+            multiple = f.multiple
+            opts = f.options
+            minv = f.min
+            maxv = f.max
 
             if ftype == "checkbox":
                 inner.append(f"""
@@ -1372,8 +1777,9 @@ def render_form(action_url: str, *, title: str, subtitle: str, submit_token: Opt
                 """)
             elif ftype == "select":
                 options_html = ['<option value="">— (puste) —</option>']
-                for o in opts:
-                    options_html.append(f'<option value="{esc(o)}">{esc(o)}</option>')
+                # value = pozycja opcji w krotce (krótki kod w POST); etykietę odtwarza _form_value
+                for i, o in enumerate(opts):
+                    options_html.append(f'<option value="{i}">{esc(o)}</option>')
                 inner.append(f"""
                 <div class="field">
                   <label>{esc(label)}</label>
@@ -1418,10 +1824,14 @@ def render_form(action_url: str, *, title: str, subtitle: str, submit_token: Opt
           </div>
         </details>
         """)
+    return ''.join(blocks)
+
 
-    return layout(
-        title,
-        body=f"""
+# Nagłówek formularza zależy od linku (tytuł, opis, action) – cache'ujemy tylko go, z małym limitem.
+# Sekcje (_form_blocks_html) i stała końcówka są wspólne dla wszystkich linków i doklejane w render_form.
+@functools.lru_cache(maxsize=256)
+def _form_head(action_url: str, title: str, subtitle: str) -> str:
+    return _layout_head(title, nav=_NAV_LINKS) + f"""
         <div class="wrap formwrap">
           <h1 style="margin:0 0 12px">{esc(title)}</h1>
           <p class="lead" style="max-width:none">{esc(subtitle)}</p>
@@ -1431,32 +1841,38 @@ def render_form(action_url: str, *, title: str, subtitle: str, submit_token: Opt
           </div>
 
           <form method="post" action="{esc(action_url)}" enctype="multipart/form-data" style="margin-top:16px">
-            {f'<input type="hidden" name="_submit_token" value="{esc(submit_token)}"/>' if submit_token else ""}
-            {''.join(blocks)}
+            """
+
+_FORM_MID = """
+            """
+_FORM_TAIL = """
             <div class="actions">
               <button class="btn gold" type="submit">Zatwierdź brief</button>
               <a class="btn" href="/">Powrót</a>
               <span class="muted">Zatwierdzenie briefu uruchamia analizę i przygotowanie raportu dla architekta.</span>
             </div>
             <script>
-              (function(){{
+              (function(){
                 var f = document.currentScript && document.currentScript.parentElement && document.currentScript.parentElement.closest("form");
-                if(!f){{ f = document.querySelector("form"); }}
+                if(!f){ f = document.querySelector("form"); }
                 if(!f) return;
-                f.addEventListener("submit", function(){{
+                f.addEventListener("submit", function(){
                   var btn = f.querySelector("button[type=submit]");
-                  if(btn){{
+                  if(btn){
                     btn.disabled = true;
                     btn.textContent = "Przetwarzanie...";
-                  }}
-                }}, {{ once: true }});
-              }})();
+                  }
+                }, { once: true });
+              })();
             </script>
           </form>
         </div>
-        """,
-        nav=nav_links()
-    )
+        """ + _LAYOUT_TAIL
+
+
+def render_form(action_url: str, *, title: str, subtitle: str, submit_token: Optional[str] = None) -> str:
+    token_html = f'<input type="hidden" name="_submit_token" value="{esc(submit_token)}"/>' if submit_token else ""
+    return "".join((_form_head(action_url, title, subtitle), token_html, _FORM_MID, _form_blocks_html(), _FORM_TAIL))
 
 
 # =========================
@@ -1469,34 +1885,17 @@ def render_form(action_url: str, *, title: str, subtitle: str, submit_token: Opt
 
 def _form_to_rows(form: Dict[str, Any]) -> List[Dict[str, str]]:
     """Zamienia form dict -> lista wierszy z sekcją i etykietą (żeby AI nie gubiło pól i nie mieszało danych)."""
-    rows: List[Dict[str, str]] = []
-    known = set()
-
-    for sec_title, fields in FORM_SCHEMA:
-        for f in fields:
-            name = f.get("name")
-            label = f.get("label", name)
-            if not name:
-                continue
-            if name in form:
-                known.add(name)
-                rows.append({
-                    "section": sec_title,
-                    "field": str(name),
-                    "label": str(label),
-                    "value": str(form.get(name)),
-                })
-
-    # Dorzuć ewentualne nieznane klucze (żeby nic nie zginęło)
-    for k, v in form.items():
-        if k not in known:
-            rows.append({
-                "section": "Inne (poza schematem)",
-                "field": str(k),
-                "label": str(k),
-                "value": str(v),
-            })
-
+    rows: List[Dict[str, str]] = [
+        {"section": sec_title, "field": name, "label": label, "value": str(form[name])}
+        for name, label, sec_title in _schema_flat()
+        if name in form
+    ]
+    # Dorzuć ewentualne nieznane klucze (żeby nic nie zginęło) – w kolejności z formularza
+    rows.extend(
+        {"section": "Inne (poza schematem)", "field": str(k), "label": str(k), "value": str(v)}
+        for k, v in form.items()
+        if k not in FIELD_INDEX
+    )
     return rows
 
 def _pln(x: float) -> str:
@@ -1505,8 +1904,10 @@ def _pln(x: float) -> str:
     except Exception:
         return str(x)
 
+_MD_ESC_TABLE = str.maketrans({"|": "\\|", "\n": " "})
+
 def _md_escape(s: str) -> str:
-    return (s or "").replace("|", "\\|").replace("\n", " ").strip()
+    return (s or "").translate(_MD_ESC_TABLE).strip()
 
 def _md_table(headers: List[str], rows: List[List[str]]) -> str:
     out = []
@@ -1516,6 +1917,9 @@ def _md_table(headers: List[str], rows: List[List[str]]) -> str:
         out.append("| " + " | ".join(_md_escape(c) for c in r) + " |")
     return "\n".join(out)
 
+def _md_bullets(items: Any) -> str:
+    return "\n".join([f"- {x}" for x in (items or [])])
+
 def render_architect_report(data: Dict[str, Any], company: Dict[str, Any], architect: Dict[str, Any]) -> str:
     meta = data.get("meta") or {}
     facts = data.get("facts") or []
@@ -1523,19 +1927,19 @@ def render_architect_report(data: Dict[str, Any], company: Dict[str, Any], archi
     bc = data.get("build_cost_estimate") or {}
     questions = data.get("questions") or {}
 
-    fact_rows: List[List[str]] = []
-    for f in facts:
-        fact_rows.append([
+    fact_rows: List[List[str]] = [
+        [
             str(f.get("section", "")),
             str(f.get("label", "")),
             str(f.get("value", "")),
             str(f.get("source", "")),
             str(round(float(f.get("confidence", 0) or 0), 2)),
-        ])
+        ]
+        for f in facts
+    ]
 
-    fee_rows: List[List[str]] = []
-    for r in (fee.get("calc_table") or []):
-        fee_rows.append([
+    fee_rows: List[List[str]] = [
+        [
             str(r.get("item", "")),
             str(r.get("basis", "")),
             str(r.get("qty", "")),
@@ -1544,7 +1948,9 @@ def render_architect_report(data: Dict[str, Any], company: Dict[str, Any], archi
             _pln(r.get("amount_pln", 0) or 0),
             str(r.get("source", "")),
             str(r.get("justification", "")),
-        ])
+        ]
+        for r in (fee.get("calc_table") or [])
+    ]
 
     build_rows = [[
         str(bc.get("standard", "")),
@@ -1557,15 +1963,16 @@ def render_architect_report(data: Dict[str, Any], company: Dict[str, Any], archi
         _pln(bc.get("total_high_pln", 0) or 0),
     ]]
 
-    risk_rows: List[List[str]] = []
-    for r in (data.get("risks") or []):
-        risk_rows.append([
+    risk_rows: List[List[str]] = [
+        [
             str(r.get("area", "")),
             str(r.get("priority", "")),
             str(r.get("risk", "")),
             str(r.get("impact", "")),
             str(r.get("mitigation", "")),
-        ])
+        ]
+        for r in (data.get("risks") or [])
+    ]
 
     client_email = data.get("client_email") or {"subject": "", "body_text": ""}
 
@@ -1591,18 +1998,18 @@ def render_architect_report(data: Dict[str, Any], company: Dict[str, Any], archi
 
 ## 3) Pytania / RFI
 **Blockery (bez tego nie domykamy wyceny / zakresu):**
-{chr(10).join([f"- {q}" for q in (questions.get("blockers") or [])])}
+{_md_bullets(questions.get("blockers"))}
 
 **Ważne (wpływ na budżet / terminy / ryzyka):**
-{chr(10).join([f"- {q}" for q in (questions.get("important") or [])])}
+{_md_bullets(questions.get("important"))}
 
 **Opcjonalne:**
-{chr(10).join([f"- {q}" for q in (questions.get("optional") or [])])}
+{_md_bullets(questions.get("optional"))}
 
 ---
 
 ## 4) Braki dokumentów / formalności
-{chr(10).join([f"- {x}" for x in (data.get("missing_docs") or [])])}
+{_md_bullets(data.get("missing_docs"))}
 
 ---
 
@@ -1614,10 +2021,10 @@ def render_architect_report(data: Dict[str, Any], company: Dict[str, Any], archi
 **Suma (widełki):** {_pln(fee.get("total_low_pln", 0) or 0)} – {_pln(fee.get("total_high_pln", 0) or 0)} PLN
 
 **W zakresie:**
-{chr(10).join([f"- {x}" for x in (fee.get("included_scope") or [])])}
+{_md_bullets(fee.get("included_scope"))}
 
 **Poza zakresem:**
-{chr(10).join([f"- {x}" for x in (fee.get("excluded_scope") or [])])}
+{_md_bullets(fee.get("excluded_scope"))}
 
 ---
 
@@ -1625,7 +2032,7 @@ def render_architect_report(data: Dict[str, Any], company: Dict[str, Any], archi
 {_md_table(["Standard", "Region", "PLN/m² low", "PLN/m² mid", "PLN/m² high", "Total low", "Total mid", "Total high"], build_rows)}
 
 **Czynniki kosztotwórcze:**
-{chr(10).join([f"- {x}" for x in (bc.get("drivers") or [])])}
+{_md_bullets(bc.get("drivers"))}
 
 ---
 
@@ -1635,12 +2042,12 @@ def render_architect_report(data: Dict[str, Any], company: Dict[str, Any], archi
 ---
 
 ## 8) Założenia (jawne)
-{chr(10).join([f"- {x}" for x in (data.get("assumptions") or [])])}
+{_md_bullets(data.get("assumptions"))}
 
 ---
 
 ## 9) Następne kroki
-{chr(10).join([f"- {x}" for x in (data.get("next_steps") or [])])}
+{_md_bullets(data.get("next_steps"))}
 
 ---
 
@@ -1654,31 +2061,23 @@ def render_architect_report(data: Dict[str, Any], company: Dict[str, Any], archi
     return report
 
 
+# Kluczowe dokumenty sprawdzane w raporcie bez AI (kolejność = kolejność na liście braków)
+_FALLBACK_KEY_DOCS: Dict[str, str] = {
+    "mpzp_wz_extract": "Wypis i wyrys MPZP / decyzja WZ",
+    "map_for_design": "Mapa do celów projektowych (geodeta)",
+    "geotech_opinion": "Opinia geotechniczna",
+    "power_conditions": "Warunki przyłączenia energii elektrycznej",
+    "water_conditions": "Warunki przyłączenia wody",
+    "sewage_conditions": "Warunki przyłączenia kanalizacji sanitarnej",
+}
+
 def fallback_report(form: Dict[str, Any], pricing_text: str) -> str:
     area = float(form.get("usable_area_m2", 0) or 0)
-    standard = form.get("cost_standard") or "Standard"
-    region = form.get("region_type") or "Mniejsze miasto / okolice"
-
-    base = BUILD_COST_M2_PLN.get(standard, 6000)
-    mult = REGION_MULTIPLIER.get(region, 1.0)
+    standard, region, base, mult = _cost_basis(form)
     build_low = int(area * base * mult * 0.9) if area else 0
     build_high = int(area * base * mult * 1.15) if area else 0
 
-    missing = []
-    for key in ("mpzp_wz_extract", "map_for_design", "geotech_opinion", "power_conditions", "water_conditions", "sewage_conditions"):
-        if not form.get(key):
-            missing.append(key)
-
-    missing_human = {
-        "mpzp_wz_extract": "Wypis i wyrys MPZP / decyzja WZ",
-        "map_for_design": "Mapa do celów projektowych (geodeta)",
-        "geotech_opinion": "Opinia geotechniczna",
-        "power_conditions": "Warunki przyłączenia energii elektrycznej",
-        "water_conditions": "Warunki przyłączenia wody",
-        "sewage_conditions": "Warunki przyłączenia kanalizacji sanitarnej",
-    }
-
-    missing_list = "\n".join([f"- {missing_human.get(m, m)}" for m in missing]) or "- (brak krytycznych braków wykrytych)"
+    missing_list = "\n".join([f"- {label}" for key, label in _FALLBACK_KEY_DOCS.items() if not form.get(key)]) or "- (brak krytycznych braków wykrytych)"
 
     pricing_note = "Cennik firmy jest pusty lub niepodany – nie wyliczono wynagrodzenia projektowego." if not pricing_text.strip() else "Cennik firmy został dołączony do analizy."
 
@@ -1703,18 +2102,47 @@ def fallback_report(form: Dict[str, Any], pricing_text: str) -> str:
 Uwaga: raport ma charakter informacyjny (MVP). Tryb AI generuje analizę ryzyk, checklisty formalne i listę pytań uzupełniających.
 """.replace(",", " ")
 
+# Jeden klient OpenAI na proces – jego pula połączeń HTTP (keep-alive/TLS) jest współdzielona między raportami
+@functools.lru_cache(maxsize=1)
+def _openai_client() -> "OpenAI":
+    return OpenAI(api_key=OPENAI_API_KEY)
+
+# Cache gotowych raportów AI: ten sam brief (retry, podwójne wysłanie) nie odpala drugiego wywołania API
+_AI_CACHE: "OrderedDict[bytes, Tuple[float, str]]" = OrderedDict()
+_AI_CACHE_LOCK = threading.Lock()
+_AI_CACHE_MAX = 256
+_AI_CACHE_TTL = 24 * 60 * 60
+
+def _ai_cache_key(user_payload: Dict[str, Any]) -> bytes:
+    raw = json.dumps([OPENAI_MODEL, user_payload], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).digest()
+
+def _ai_cache_get(key: bytes) -> Optional[str]:
+    with _AI_CACHE_LOCK:
+        hit = _AI_CACHE.get(key)
+        if hit is None:
+            return None
+        if time.time() - hit[0] > _AI_CACHE_TTL:
+            del _AI_CACHE[key]
+            return None
+        _AI_CACHE.move_to_end(key)
+        return hit[1]
+
+def _ai_cache_put(key: bytes, report: str) -> None:
+    with _AI_CACHE_LOCK:
+        _AI_CACHE[key] = (time.time(), report)
+        _AI_CACHE.move_to_end(key)
+        while len(_AI_CACHE) > _AI_CACHE_MAX:
+            _AI_CACHE.popitem(last=False)
+
 def ai_report(form: Dict[str, Any], pricing_text: str, company: Dict[str, Any], architect: Dict[str, Any]) -> str:
     if not OPENAI_API_KEY or OpenAI is None:
         return fallback_report(form, pricing_text)
 
-    client = OpenAI(api_key=OPENAI_API_KEY)
-
     # Baseline (pomocnicze) – liczby liczymy deterministycznie, AI ma je opisać/uzasadnić i ewentualnie skorygować jako jawne założenia
     area = float(form.get("usable_area_m2", 0) or 0)
-    standard = form.get("cost_standard") or "Standard"
-    region = form.get("region_type") or "Mniejsze miasto / okolice"
-    base = float(BUILD_COST_M2_PLN.get(standard, BUILD_COST_M2_PLN.get("Standard", 6000)))
-    mult = float(REGION_MULTIPLIER.get(region, 1.0))
+    standard, region, base, mult = _cost_basis(form)
+    base = float(base)  # w payloadzie do AI jako float (jak dotąd)
     unit_mid = base * mult
     unit_low = unit_mid * 0.90
     unit_high = unit_mid * 1.15
@@ -1766,23 +2194,33 @@ def ai_report(form: Dict[str, Any], pricing_text: str, company: Dict[str, Any],
         "notes": "Jeśli standard/region nie występują w briefie, potraktuj je jako assumption i jasno wpisz w assumptions."
     }
 
+    # Klucz z pełnego payloadu – zmiana cennika, briefu albo danych firmy/architekta daje nowy raport
+    cache_key = _ai_cache_key(user_payload)
+    cached = _ai_cache_get(cache_key)
+    if cached is not None:
+        return cached
+
+    client = _openai_client()
+
     try:
         resp = client.chat.completions.create(
             model=OPENAI_MODEL,
             response_format={"type": "json_schema", "json_schema": REPORT_SCHEMA},
             messages=[
                 {"role": "system", "content": system},
-                {"role": "user", "content": json.dumps(user_payload, ensure_ascii=False)},
+                {"role": "user", "content": _json_text(user_payload)},
             ],
             
         )
 
         content = (resp.choices[0].message.content or "").strip()
-        data = json.loads(content) if content else None
+        data = _json_loads(content) if content else None
         if not isinstance(data, dict):
             return fallback_report(form, pricing_text) + "\n\n[AI ERROR: invalid JSON]"
 
-        return render_architect_report(data, company, architect)
+        report = render_architect_report(data, company, architect)
+        _ai_cache_put(cache_key, report)
+        return report
 
     except Exception as e:
         return fallback_report(form, pricing_text) + f"\n\n[AI ERROR: {type(e).__name__}: {e}]"
@@ -1793,17 +2231,22 @@ def _safe_err(e: BaseException) -> str:
         parts.append(f"errno={e.errno}")
     return " | ".join(parts)
 
+# Kontekst TLS (wczytane certyfikaty CA) tworzony raz i współdzielony przez wysyłki Resend/SMTP
+@functools.lru_cache(maxsize=1)
+def _ssl_context() -> ssl.SSLContext:
+    return ssl.create_default_context()
+
 def send_email_via_resend(to_email: str, subject: str, body: str) -> tuple[bool, str]:
     if not (RESEND_API_KEY and RESEND_FROM):
         return False, "RESEND not configured (missing RESEND_API_KEY or RESEND_FROM)"
     try:
         import urllib.request
-        payload = json.dumps({
+        payload = _json_bytes({
             "from": RESEND_FROM,
             "to": [to_email],
             "subject": subject,
             "text": body,
-        }).encode("utf-8")
+        })
 
         req = urllib.request.Request(
             "https://api.resend.com/emails",
@@ -1814,7 +2257,7 @@ def send_email_via_resend(to_email: str, subject: str, body: str) -> tuple[bool,
             },
             method="POST",
         )
-        with urllib.request.urlopen(req, timeout=20) as resp:
+        with urllib.request.urlopen(req, timeout=20, context=_ssl_context()) as resp:
             code = int(getattr(resp, "status", 200))
             text = resp.read().decode("utf-8", errors="replace")
             if 200 <= code < 300:
@@ -1836,11 +2279,11 @@ def send_email_via_smtp(to_email: str, subject: str, body: str) -> tuple[bool, s
         msg["Subject"] = subject
         msg.set_content(body)
 
-        print(f"[EMAIL] SMTP connect {SMTP_HOST}:{SMTP_PORT} as {BOT_EMAIL}")
+        log.info("[EMAIL] SMTP connect %s:%s as %s", SMTP_HOST, SMTP_PORT, BOT_EMAIL)
 
         with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=20) as s:
             s.ehlo()
-            s.starttls(context=ssl.create_default_context())
+            s.starttls(context=_ssl_context())
             s.ehlo()
             s.login(BOT_EMAIL, BOT_EMAIL_PASSWORD)
             s.send_message(msg)
@@ -1854,21 +2297,21 @@ def send_email_via_smtp(to_email: str, subject: str, body: str) -> tuple[bool, s
 def send_email(to_email: str, subject: str, body: str, *, delivery_id: str) -> bool:
     to_email = (to_email or "").strip()
     if not to_email:
-        print(f"[EMAIL] FAIL delivery_id={delivery_id} reason=missing recipient")
+        log.warning("[EMAIL] FAIL delivery_id=%s reason=missing recipient", delivery_id)
         return False
 
     ok, reason = send_email_via_resend(to_email, subject, body)
     if ok:
-        print(f"[EMAIL] OK delivery_id={delivery_id} via=RESEND to={to_email} detail={reason}")
+        log.info("[EMAIL] OK delivery_id=%s via=RESEND to=%s detail=%s", delivery_id, to_email, reason)
         return True
-    print(f"[EMAIL] RESEND not sent delivery_id={delivery_id} to={to_email} detail={reason}")
+    log.info("[EMAIL] RESEND not sent delivery_id=%s to=%s detail=%s", delivery_id, to_email, reason)
 
     ok2, reason2 = send_email_via_smtp(to_email, subject, body)
     if ok2:
-        print(f"[EMAIL] OK delivery_id={delivery_id} via=SMTP to={to_email} detail={reason2}")
+        log.info("[EMAIL] OK delivery_id=%s via=SMTP to=%s detail=%s", delivery_id, to_email, reason2)
         return True
 
-    print(f"[EMAIL] FAIL delivery_id={delivery_id} to={to_email} detail={reason2}")
+    log.warning("[EMAIL] FAIL delivery_id=%s to=%s detail=%s", delivery_id, to_email, reason2)
     return False
 
 
@@ -1886,13 +2329,30 @@ def subscription_active(company: Dict[str, Any]) -> bool:
     st = (company.get("stripe") or {}).get("status") or ""
     if st in ("active", "trialing"):
         return True
-    plan = _company_plan(company)
-    return bool(ENABLE_FREE_PLAN and plan == "free")
+    return ENABLE_FREE_PLAN and _company_plan(company) == "free"
 
 def stripe_init() -> None:
     if stripe_ready():
         stripe.api_key = STRIPE_SECRET_KEY  # type: ignore
 
+def _verify_stripe_signature(payload: bytes, sig_header: str, secret: str, tolerance: int = 300) -> bool:
+    """Weryfikacja nagłówka Stripe-Signature (t=…,v1=…) lokalnie: HMAC-SHA256 z "t.payload"."""
+    ts = ""
+    sigs: List[str] = []
+    for part in sig_header.split(","):
+        k, _, v = part.strip().partition("=")
+        if k == "t":
+            ts = v
+        elif k == "v1":
+            sigs.append(v)
+    # int() przyjąłby też cyfry spoza ASCII ("١٢"), a niżej ts idzie przez .encode("ascii")
+    if not ts or not sigs or not (ts.isascii() and ts.isdigit()):
+        return False
+    if abs(time.time() - int(ts)) > tolerance:
+        return False
+    expected = hmac.new(secret.encode("utf-8"), ts.encode("ascii") + b"." + payload, hashlib.sha256).hexdigest()
+    return any(hmac.compare_digest(expected, s) for s in sigs)
+
 
 # =========================
 # 9) App + auth – bez zmian
@@ -1921,11 +2381,14 @@ def favicon_ico():
     return RedirectResponse(url="/logo_arch.png")
 
 
-def get_company(request: Request) -> Optional[Dict[str, Any]]:
+def get_company(request: Request, db: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Firma zalogowana w sesji. Handlery async przekazują `db` z _load_db_async – bez tego
+    _load_db (stat + ewentualny odczyt pliku) szłoby w pętli zdarzeń."""
     cid = request.session.get("company_id")
     if not cid:
         return None
-    db = _load_db()
+    if db is None:
+        db = _load_db()
     return db["companies"].get(cid)
 
 def require_company(request: Request) -> Optional[RedirectResponse]:
@@ -1945,8 +2408,9 @@ def flash_html(msg: str) -> str:
 # 10) Landing page – minimalnie poprawione copy
 # =========================
 
-@app.get("/", response_class=HTMLResponse)
-def home(request: Request):
+# Treść strony głównej zależy tylko od stałych modułu i roku w stopce – budowana raz na rok
+@functools.lru_cache(maxsize=2)
+def _home_body(year: int) -> str:
     free_card = ""
     if ENABLE_FREE_PLAN:
         free_card = f'''
@@ -2240,7 +2704,7 @@ def home(request: Request):
 
         <div class="foot">
           <div class="wrap" style="display:flex;justify-content:space-between;gap:12px;flex-wrap:wrap;">
-            <div>© {esc(APP_NAME)} • {esc(datetime.datetime.utcnow().year)}</div>
+            <div>© {_ESC_APP_NAME} • {year}</div>
             <div style="display:flex;gap:12px;flex-wrap:wrap">
               <a href="/terms">Regulamin</a>
               <a href="/privacy">Polityka prywatności</a>
@@ -2251,15 +2715,20 @@ def home(request: Request):
       </section>
     </div>
     '''
+    return body
 
-    return HTMLResponse(layout("Start", body=body, nav=nav_links(), request=request, page="home"))
+@app.get("/", response_class=HTMLResponse)
+def home(request: Request):
+    body = _home_body(time.gmtime().tm_year)
+    return HTMLResponse(layout("Start", body=body, nav=_NAV_LINKS, request=request, page="home"))
 
 # =========================
 # 11) Auth: rejestracja / logowanie – bez zmian
 # =========================
 
-@app.get("/register", response_class=HTMLResponse)
-def register_page():
+# Strony logowania/rejestracji nie zależą od requestu – gotowy HTML (bajty) składany raz
+@functools.lru_cache(maxsize=1)
+def _register_page_html() -> bytes:
     body = """
     <div class="wrap formwrap">
       <h1 style="margin:0 0 10px">Załóż konto firmy</h1>
@@ -2280,7 +2749,11 @@ def register_page():
       </div>
     </div>
     """
-    return HTMLResponse(layout("Rejestracja", body=body, nav=nav_links()))
+    return layout("Rejestracja", body=body, nav=_NAV_LINKS).encode("utf-8")
+
+@app.get("/register", response_class=HTMLResponse)
+def register_page():
+    return HTMLResponse(_register_page_html())
 
 @app.post("/register")
 async def register(request: Request):
@@ -2290,19 +2763,22 @@ async def register(request: Request):
     password = (form.get("password") or "").strip()
 
     if not name or not email or not password or len(password) < 8:
-        return HTMLResponse(layout("Rejestracja", body=flash_html("Uzupełnij nazwę, email i hasło (min. 8 znaków).") + '<div class="wrap formwrap"><a class="btn" href="/register">Wróć</a></div>', nav=nav_links()))
+        return HTMLResponse(layout("Rejestracja", body=flash_html("Uzupełnij nazwę, email i hasło (min. 8 znaków).") + '<div class="wrap formwrap"><a class="btn" href="/register">Wróć</a></div>', nav=_NAV_LINKS))
 
-    db = _load_db()
-    for c in db["companies"].values():
-        if c.get("email") == email:
-            return HTMLResponse(layout("Rejestracja", body=flash_html("Ten email jest już użyty.") + '<div class="wrap formwrap"><a class="btn" href="/register">Wróć</a></div>', nav=nav_links()))
+    # PBKDF2 (~40 ms CPU) w puli wątków – pbkdf2_hmac zwalnia GIL, pętla zdarzeń obsługuje w tym czasie inne żądania.
+    # Liczone przed sprawdzeniem emaila, żeby między sprawdzeniem a wstawieniem firmy nie było await.
+    password_hash = await run_in_threadpool(_hash_password, password)
+
+    db = await _load_db_async()
+    if email in _email_index(db):
+        return HTMLResponse(layout("Rejestracja", body=flash_html("Ten email jest już użyty.") + '<div class="wrap formwrap"><a class="btn" href="/register">Wróć</a></div>', nav=_NAV_LINKS))
 
     cid = _new_id("cmp")
     db["companies"][cid] = {
         "id": cid,
         "name": name,
         "email": email,
-        "password_hash": _hash_password(password),
+        "password_hash": password_hash,
         "created_at": _now_ts(),
         "pricing_text": "",
         "billing": {"company_name": "", "nip": "", "address": "", "invoice_email": ""},
@@ -2312,13 +2788,14 @@ async def register(request: Request):
         "stripe": {"status": "inactive", "customer_id": "", "subscription_id": ""},
         "plan": ("free" if ENABLE_FREE_PLAN else "none"),
     }
-    _save_db(db)
+    _email_index(db)[email] = cid
+    await _save_db_async(db, cid)
 
     request.session["company_id"] = cid
     return RedirectResponse(url="/dashboard", status_code=302)
 
-@app.get("/login", response_class=HTMLResponse)
-def login_page():
+@functools.lru_cache(maxsize=1)
+def _login_page_html() -> bytes:
     body = """
     <div class="wrap formwrap">
       <h1 style="margin:0 0 10px">Zaloguj się</h1>
@@ -2338,7 +2815,57 @@ def login_page():
       </div>
     </div>
     """
-    return HTMLResponse(layout("Logowanie", body=body, nav=nav_links()))
+    return layout("Logowanie", body=body, nav=_NAV_LINKS).encode("utf-8")
+
+@app.get("/login", response_class=HTMLResponse)
+def login_page():
+    return HTMLResponse(_login_page_html())
+
+# Nieudane logowania per (IP klienta, email) w krótkim oknie. Po przekroczeniu limitu próba czeka
+# _LOGIN_FAIL_DELAY_S (asyncio.sleep, pętla obsługuje w tym czasie inne żądania) i dopiero potem liczy PBKDF2,
+# a dla jednego klucza liczy się naraz najwyżej jedna taka próba – równoległe dostają 429 bez PBKDF2.
+# Poprawne hasło w przepuszczonej próbie loguje – cudze błędne próby nie blokują konta na stałe.
+# Używane tylko z handlera async (pętla zdarzeń), więc bez locka.
+_LOGIN_FAILS: "OrderedDict[Tuple[str, str], Tuple[float, int]]" = OrderedDict()
+_LOGIN_THROTTLED_INFLIGHT: set = set()
+_LOGIN_FAIL_WINDOW = 60
+_LOGIN_FAIL_MAX = 5
+_LOGIN_FAIL_DELAY_S = 2.0
+_LOGIN_FAILS_MAX_KEYS = 4096
+
+def _client_ip(request: Request) -> str:
+    if FORWARDED_PROXY_HOPS:
+        hops = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+        if len(hops) >= FORWARDED_PROXY_HOPS:
+            return hops[-FORWARDED_PROXY_HOPS]
+    return request.client.host if request.client else ""
+
+def _login_throttled(key: Tuple[str, str]) -> bool:
+    hit = _LOGIN_FAILS.get(key)
+    if hit is None:
+        return False
+    if time.time() - hit[0] > _LOGIN_FAIL_WINDOW:
+        del _LOGIN_FAILS[key]
+        return False
+    return hit[1] >= _LOGIN_FAIL_MAX
+
+def _login_failed(key: Tuple[str, str]) -> None:
+    now = time.time()
+    first, n = _LOGIN_FAILS.pop(key, (now, 0))
+    if now - first > _LOGIN_FAIL_WINDOW:
+        first, n = now, 0
+    _LOGIN_FAILS[key] = (first, n + 1)
+    if len(_LOGIN_FAILS) > _LOGIN_FAILS_MAX_KEYS:
+        # Najpierw wygasłe i te poniżej limitu – zalewanie tabeli nowymi kluczami nie kasuje aktywnych blokad.
+        # Czyścimy do 3/4 limitu, żeby przegląd tabeli nie szedł przy każdej kolejnej próbie.
+        drop = [k for k, (t, c) in _LOGIN_FAILS.items() if now - t > _LOGIN_FAIL_WINDOW or c < _LOGIN_FAIL_MAX]
+        for k in drop[:len(_LOGIN_FAILS) - _LOGIN_FAILS_MAX_KEYS * 3 // 4]:
+            del _LOGIN_FAILS[k]
+        while len(_LOGIN_FAILS) > _LOGIN_FAILS_MAX_KEYS:
+            _LOGIN_FAILS.popitem(last=False)
+
+def _login_throttled_response() -> HTMLResponse:
+    return HTMLResponse(layout("Logowanie", body=flash_html("Zbyt wiele nieudanych prób logowania. Spróbuj ponownie za minutę.") + '<div class="wrap formwrap"><a class="btn" href="/login">Wróć</a></div>', nav=_NAV_LINKS), status_code=429)
 
 @app.post("/login")
 async def login(request: Request):
@@ -2346,13 +2873,33 @@ async def login(request: Request):
     email = (form.get("email") or "").strip().lower()
     password = (form.get("password") or "").strip()
 
-    db = _load_db()
-    for cid, c in db["companies"].items():
-        if c.get("email") == email and _verify_password(password, c.get("password_hash", "")):
-            request.session["company_id"] = cid
-            return RedirectResponse(url="/dashboard", status_code=302)
+    throttle_key = (_client_ip(request), email)
+    throttled = _login_throttled(throttle_key)
+    if throttled:
+        if throttle_key in _LOGIN_THROTTLED_INFLIGHT:
+            return _login_throttled_response()
+        _LOGIN_THROTTLED_INFLIGHT.add(throttle_key)
+    try:
+        if throttled:
+            await asyncio.sleep(_LOGIN_FAIL_DELAY_S)
+
+        db = await _load_db_async()
+        cid = _email_index(db).get(email)
+        c = db["companies"].get(cid) if cid else None
+        ok = c is not None and await run_in_threadpool(_verify_password, password, c.get("password_hash", ""))
+    finally:
+        if throttled:
+            _LOGIN_THROTTLED_INFLIGHT.discard(throttle_key)
 
-    return HTMLResponse(layout("Logowanie", body=flash_html("Błędny email lub hasło.") + '<div class="wrap formwrap"><a class="btn" href="/login">Wróć</a></div>', nav=nav_links()))
+    if ok:
+        _LOGIN_FAILS.pop(throttle_key, None)
+        request.session["company_id"] = cid
+        return RedirectResponse(url="/dashboard", status_code=302)
+
+    _login_failed(throttle_key)
+    if throttled:
+        return _login_throttled_response()
+    return HTMLResponse(layout("Logowanie", body=flash_html("Błędny email lub hasło.") + '<div class="wrap formwrap"><a class="btn" href="/login">Wróć</a></div>', nav=_NAV_LINKS))
 
 @app.get("/logout")
 def logout(request: Request):
@@ -2364,6 +2911,157 @@ def logout(request: Request):
 # 12) Dashboard firmy – bez zmian merytorycznych
 # =========================
 
+# Stałe fragmenty panelu – budowane raz przy imporcie, w handlerze doklejamy tylko wartości dynamiczne
+_DASH_HEAD = '''
+    <div class="wrap">
+      <div class="dash">
+        '''
+_DASH_MID = '''
+        <div class="panel main card">
+          '''
+_DASH_TAIL = '''
+        </div>
+      </div>
+    </div>
+    '''
+
+_DASH_ARCH_OPEN = '''
+        <div class="headrow">
+          <div>
+            <h1 class="h1">Architekci</h1>
+            <p class="lead sub">Każdy architekt dostaje własny link do formularza. Wysyłasz inwestorowi i czekasz na raport.</p>
+          </div>
+        </div>
+
+        <div class="panel card">
+          <div class="k">DODAJ ARCHITEKTA</div>
+          <div style="height:10px"></div>
+          <form method="post" action="/dashboard/architect/add">
+            <div class="fields">
+              <div class="field"><label>Imię i nazwisko</label><input name="name" placeholder="np. Jan Kowalski"/></div>
+              <div class="field"><label>Email (na ten adres idzie raport)</label><input type="email" name="email" placeholder="jan@..."/></div>
+            </div>
+            <div style="height:12px"></div>
+            <div class="actions">
+              <button class="btn gold" type="submit">Dodaj</button>
+              <a class="btn ghost" href="/demo" target="_blank">Zobacz brief</a>
+            </div>
+          </form>
+        </div>
+
+        <div style="height:14px"></div>
+        '''
+_DASH_ARCH_CLOSE = '''
+        '''
+_DASH_ARCH_ROW = '''
+              <tr>
+                <td><b>{name}</b><div class="muted">{email}</div></td>
+                <td>
+                  <div class="notice mono" id="l_{aid}">{link}</div>
+                  <div style="height:8px"></div>
+                  <div class="actions">
+                    <button class="btn" data-copy="#l_{aid}">Kopiuj</button>
+                    <a class="btn ghost" href="{link}" target="_blank">Otwórz</a>
+                    <a class="btn" href="/dashboard/architect/delete?id={aid}" onclick="return confirm('Usunąć architekta?')">Usuń</a>
+                  </div>
+                </td>
+              </tr>
+            '''
+_DASH_ARCH_EMPTY = '<div class="notice">Brak architektów. Dodaj pierwszego — wtedy pojawi się link do briefu.</div>'
+_DASH_ARCH_TABLE_OPEN = '''
+              <table class="table">
+                <thead><tr><th>Architekt</th><th>Link do briefu</th></tr></thead>
+                <tbody>'''
+_DASH_ARCH_TABLE_CLOSE = '''</tbody>
+              </table>
+            '''
+
+_DASH_PRICING_OPEN = '''
+        <div class="headrow">
+          <div>
+            <h1 class="h1">Cennik</h1>
+            <p class="lead sub">Opcjonalnie. Jeśli wkleisz cennik, raport spróbuje podać widełki i logikę wyceny.</p>
+          </div>
+        </div>
+
+        <div class="panel card">
+          <form method="post" action="/dashboard/pricing">
+            <div class="field full">
+              <label>Tekst cennika</label>
+              <textarea name="pricing_text" placeholder="Wklej zasady wyceny (np. stawki / zakres / założenia)">'''
+_DASH_PRICING_CLOSE = '''</textarea>
+              <div class="muted" style="margin-top:8px">Tip: wrzuć format „pakiety + dopłaty + wyłączenia”.</div>
+            </div>
+            <div style="height:12px"></div>
+            <div class="actions">
+              <button class="btn gold" type="submit">Zapisz</button>
+            </div>
+          </form>
+        </div>
+        '''
+
+_DASH_BILLING_TMPL = '''
+        <div class="headrow">
+          <div>
+            <h1 class="h1">Faktury</h1>
+            <p class="lead sub">Dane do faktury / rozliczeń. (Stripe może też pobierać te dane w swoim portalu.)</p>
+          </div>
+        </div>
+
+        <div class="panel card">
+          <form method="post" action="/dashboard/billing">
+            <div class="fields">
+              <div class="field"><label>Nazwa firmy</label><input name="company_name" value="{company_name}" placeholder="np. Pracownia XYZ Sp. z o.o."/></div>
+              <div class="field"><label>NIP</label><input name="nip" value="{nip}" placeholder="np. 1234567890"/></div>
+              <div class="field full"><label>Adres</label><input name="address" value="{address}" placeholder="ul. ..., miasto"/></div>
+              <div class="field full"><label>Email do faktur</label><input type="email" name="invoice_email" value="{invoice_email}" placeholder="np. faktury@..."/></div>
+            </div>
+            <div style="height:12px"></div>
+            <div class="actions">
+              <button class="btn gold" type="submit">Zapisz</button>
+            </div>
+          </form>
+        </div>
+        '''
+
+_DASH_REPORTS_OPEN = f'''
+            <div class="headrow">
+              <div>
+                <h1 class="h1">Raporty</h1>
+                <p class="lead sub">Historia ostatnich raportów (limit: {MAX_REPORTS_PER_COMPANY}).</p>
+              </div>
+              <div class="actions">
+                <a class="btn ghost" href="/report-demo" target="_blank">Zobacz demo</a>
+              </div>
+            </div>
+
+            <table class="table">
+              <thead><tr><th>Raport</th><th>Architekt</th><th>Akcje</th></tr></thead>
+              <tbody>'''
+_DASH_REPORTS_CLOSE = '''</tbody>
+            </table>
+            '''
+_DASH_REPORTS_EMPTY = '''
+            <div class="headrow">
+              <div>
+                <h1 class="h1">Raporty</h1>
+                <p class="lead sub">Tu będzie historia raportów po pierwszych wypełnieniach briefu.</p>
+              </div>
+            </div>
+            <div class="notice">Brak raportów. Dodaj architekta → wyślij link do inwestora → raport pojawi się tutaj.</div>
+            '''
+
+_DASH_PAY_ACTIONS = '''
+              <div class="actions">
+                <a class="btn gold" href="/stripe/checkout/monthly">Kup miesięczny</a>
+                <a class="btn" href="/stripe/checkout/yearly">Kup roczny</a>
+                <a class="btn ghost" href="/billing/portal">Zarządzaj subskrypcją</a>
+                <a class="btn ghost" href="/billing/portal">Anuluj subskrypcję</a>
+              </div>
+              <div class="muted" style="margin-top:10px">Uwaga: anulowanie/zmiana planu odbywa się w portalu Stripe.</div>
+            '''
+_DASH_PAY_OFF = '<div class="notice">Stripe nie jest skonfigurowany na serwerze (brak kluczy ENV). Skontaktuj się z adminem wdrożenia.</div>'
+
 @app.get("/dashboard", response_class=HTMLResponse)
 def dashboard(request: Request, tab: str = "overview"):
     gate = require_company(request)
@@ -2373,16 +3071,13 @@ def dashboard(request: Request, tab: str = "overview"):
     company = get_company(request)
     assert company is not None
 
-    # Refresh usage window
-    _ensure_usage_period(company)
-    sent = int((company.get("usage") or {}).get("forms_sent") or 0)
+    sent = _forms_sent(company)
     remaining = _forms_remaining(company)
     plan = _company_plan(company)
     access_ok = subscription_active(company)
 
-    _ensure_reports(company)
     architects = list(company.get("architects") or [])
-    reports = list(company.get("reports") or [])
+    reports = list(_company_reports(company))
     reports.sort(key=lambda r: int(r.get("created_at") or 0), reverse=True)
 
     allowed_tabs = {
@@ -2502,113 +3197,33 @@ def dashboard(request: Request, tab: str = "overview"):
         # list architects
         rows = []
         for a in architects:
-            aid = str(a.get("id") or "")
-            name = str(a.get("name") or "")
-            email = str(a.get("email") or "")
-            token = str(a.get("token") or "")
-            link = f"{BASE_URL}/f/{token}"
-            rows.append(f'''
-              <tr>
-                <td><b>{esc(name)}</b><div class="muted">{esc(email)}</div></td>
-                <td>
-                  <div class="notice mono" id="l_{esc(aid)}">{esc(link)}</div>
-                  <div style="height:8px"></div>
-                  <div class="actions">
-                    <button class="btn" data-copy="#l_{esc(aid)}">Kopiuj</button>
-                    <a class="btn ghost" href="{esc(link)}" target="_blank">Otwórz</a>
-                    <a class="btn" href="/dashboard/architect/delete?id={esc(aid)}" onclick="return confirm('Usunąć architekta?')">Usuń</a>
-                  </div>
-                </td>
-              </tr>
-            ''')
+            aid = esc(str(a.get("id") or ""))
+            link = esc(f"{BASE_URL}/f/{a.get('token') or ''}")
+            rows.append(_DASH_ARCH_ROW.format(
+                name=esc(str(a.get("name") or "")),
+                email=esc(str(a.get("email") or "")),
+                link=link,
+                aid=aid,
+            ))
         if not rows:
-            rows_html = '<div class="notice">Brak architektów. Dodaj pierwszego — wtedy pojawi się link do briefu.</div>'
+            rows_html = _DASH_ARCH_EMPTY
         else:
-            rows_html = f'''
-              <table class="table">
-                <thead><tr><th>Architekt</th><th>Link do briefu</th></tr></thead>
-                <tbody>{''.join(rows)}</tbody>
-              </table>
-            '''
+            rows_html = "".join((_DASH_ARCH_TABLE_OPEN, "".join(rows), _DASH_ARCH_TABLE_CLOSE))
 
-        content = f'''
-        <div class="headrow">
-          <div>
-            <h1 class="h1">Architekci</h1>
-            <p class="lead sub">Każdy architekt dostaje własny link do formularza. Wysyłasz inwestorowi i czekasz na raport.</p>
-          </div>
-        </div>
-
-        <div class="panel card">
-          <div class="k">DODAJ ARCHITEKTA</div>
-          <div style="height:10px"></div>
-          <form method="post" action="/dashboard/architect/add">
-            <div class="fields">
-              <div class="field"><label>Imię i nazwisko</label><input name="name" placeholder="np. Jan Kowalski"/></div>
-              <div class="field"><label>Email (na ten adres idzie raport)</label><input type="email" name="email" placeholder="jan@..."/></div>
-            </div>
-            <div style="height:12px"></div>
-            <div class="actions">
-              <button class="btn gold" type="submit">Dodaj</button>
-              <a class="btn ghost" href="/demo" target="_blank">Zobacz brief</a>
-            </div>
-          </form>
-        </div>
-
-        <div style="height:14px"></div>
-        {rows_html}
-        '''
+        content = "".join((_DASH_ARCH_OPEN, rows_html, _DASH_ARCH_CLOSE))
 
     elif tab == "pricing":
         pt = (company.get("pricing_text") or "").strip()
-        content = f'''
-        <div class="headrow">
-          <div>
-            <h1 class="h1">Cennik</h1>
-            <p class="lead sub">Opcjonalnie. Jeśli wkleisz cennik, raport spróbuje podać widełki i logikę wyceny.</p>
-          </div>
-        </div>
-
-        <div class="panel card">
-          <form method="post" action="/dashboard/pricing">
-            <div class="field full">
-              <label>Tekst cennika</label>
-              <textarea name="pricing_text" placeholder="Wklej zasady wyceny (np. stawki / zakres / założenia)">{esc(pt)}</textarea>
-              <div class="muted" style="margin-top:8px">Tip: wrzuć format „pakiety + dopłaty + wyłączenia”.</div>
-            </div>
-            <div style="height:12px"></div>
-            <div class="actions">
-              <button class="btn gold" type="submit">Zapisz</button>
-            </div>
-          </form>
-        </div>
-        '''
+        content = "".join((_DASH_PRICING_OPEN, esc(pt), _DASH_PRICING_CLOSE))
 
     elif tab == "billing":
         b = company.get("billing") or {}
-        content = f'''
-        <div class="headrow">
-          <div>
-            <h1 class="h1">Faktury</h1>
-            <p class="lead sub">Dane do faktury / rozliczeń. (Stripe może też pobierać te dane w swoim portalu.)</p>
-          </div>
-        </div>
-
-        <div class="panel card">
-          <form method="post" action="/dashboard/billing">
-            <div class="fields">
-              <div class="field"><label>Nazwa firmy</label><input name="company_name" value="{esc(str(b.get("company_name") or ""))}" placeholder="np. Pracownia XYZ Sp. z o.o."/></div>
-              <div class="field"><label>NIP</label><input name="nip" value="{esc(str(b.get("nip") or ""))}" placeholder="np. 1234567890"/></div>
-              <div class="field full"><label>Adres</label><input name="address" value="{esc(str(b.get("address") or ""))}" placeholder="ul. ..., miasto"/></div>
-              <div class="field full"><label>Email do faktur</label><input type="email" name="invoice_email" value="{esc(str(b.get("invoice_email") or ""))}" placeholder="np. faktury@..."/></div>
-            </div>
-            <div style="height:12px"></div>
-            <div class="actions">
-              <button class="btn gold" type="submit">Zapisz</button>
-            </div>
-          </form>
-        </div>
-        '''
+        content = _DASH_BILLING_TMPL.format(
+            company_name=esc(str(b.get("company_name") or "")),
+            nip=esc(str(b.get("nip") or "")),
+            address=esc(str(b.get("address") or "")),
+            invoice_email=esc(str(b.get("invoice_email") or "")),
+        )
 
     elif tab == "reports":
         def fmt(ts: int) -> str:
@@ -2638,32 +3253,9 @@ def dashboard(request: Request, tab: str = "overview"):
                     </td>
                   </tr>
                 ''')
-            content = f'''
-            <div class="headrow">
-              <div>
-                <h1 class="h1">Raporty</h1>
-                <p class="lead sub">Historia ostatnich raportów (limit: {MAX_REPORTS_PER_COMPANY}).</p>
-              </div>
-              <div class="actions">
-                <a class="btn ghost" href="/report-demo" target="_blank">Zobacz demo</a>
-              </div>
-            </div>
-
-            <table class="table">
-              <thead><tr><th>Raport</th><th>Architekt</th><th>Akcje</th></tr></thead>
-              <tbody>{''.join(rows)}</tbody>
-            </table>
-            '''
+            content = "".join((_DASH_REPORTS_OPEN, "".join(rows), _DASH_REPORTS_CLOSE))
         else:
-            content = f'''
-            <div class="headrow">
-              <div>
-                <h1 class="h1">Raporty</h1>
-                <p class="lead sub">Tu będzie historia raportów po pierwszych wypełnieniach briefu.</p>
-              </div>
-            </div>
-            <div class="notice">Brak raportów. Dodaj architekta → wyślij link do inwestora → raport pojawi się tutaj.</div>
-            '''
+            content = _DASH_REPORTS_EMPTY
 
     elif tab == "plan":
         stripe_status = str((company.get("stripe") or {}).get("status") or "inactive")
@@ -2671,19 +3263,7 @@ def dashboard(request: Request, tab: str = "overview"):
         badge = '<span class="badge ok">Stripe OK</span>' if stripe_ready_flag else '<span class="badge bad">Stripe OFF</span>'
         status_badge = '<span class="badge ok">dostęp aktywny</span>' if access_ok else '<span class="badge bad">brak dostępu</span>'
 
-        pay_actions = ""
-        if stripe_ready_flag:
-            pay_actions = f'''
-              <div class="actions">
-                <a class="btn gold" href="/stripe/checkout/monthly">Kup miesięczny</a>
-                <a class="btn" href="/stripe/checkout/yearly">Kup roczny</a>
-                <a class="btn ghost" href="/billing/portal">Zarządzaj subskrypcją</a>
-                <a class="btn ghost" href="/billing/portal">Anuluj subskrypcję</a>
-              </div>
-              <div class="muted" style="margin-top:10px">Uwaga: anulowanie/zmiana planu odbywa się w portalu Stripe.</div>
-            '''
-        else:
-            pay_actions = '<div class="notice">Stripe nie jest skonfigurowany na serwerze (brak kluczy ENV). Skontaktuj się z adminem wdrożenia.</div>'
+        pay_actions = _DASH_PAY_ACTIONS if stripe_ready_flag else _DASH_PAY_OFF
 
         content = f'''
         <div class="headrow">
@@ -2711,17 +3291,9 @@ def dashboard(request: Request, tab: str = "overview"):
         </div>
         '''
 
-    body = f'''
-    <div class="wrap">
-      <div class="dash">
-        {sidebar}
-        <div class="panel main card">
-          {content}
-        </div>
-      </div>
-    </div>
-    '''
-    return HTMLResponse(layout("Panel firmy", body=body, nav="", request=request, page="dash"))
+    head = _layout_head("Panel firmy", nav="", request=request, page="dash")
+    return HTMLResponse("".join((head, _DASH_HEAD, sidebar, _DASH_MID, content, _DASH_TAIL, _LAYOUT_TAIL)))
+
 @app.get("/dashboard/plan/free")
 def dashboard_set_free_plan(request: Request):
     gate = require_company(request)
@@ -2742,32 +3314,31 @@ def dashboard_set_free_plan(request: Request):
     cid = company["id"]
     if cid in db.get("companies", {}):
         db["companies"][cid]["plan"] = "free"
-        _save_db(db)
+        _save_db(db, cid)
     return RedirectResponse(url="/dashboard", status_code=302)
 @app.post("/dashboard/pricing")
 async def save_pricing(request: Request):
-    gate = require_company(request)
-    if gate:
-        return gate
-    company = get_company(request)
-    assert company is not None
+    db = await _load_db_async()
+    company = get_company(request, db)
+    if company is None:
+        return RedirectResponse(url="/login", status_code=302)
 
     form = await request.form()
     pricing_text = (form.get("pricing_text") or "").strip()
 
-    db = _load_db()
     cid = company["id"]
-    db["companies"][cid]["pricing_text"] = pricing_text
-    _save_db(db)
+    # Zapis bez zmian nie przepisuje całej bazy
+    if db["companies"][cid].get("pricing_text") != pricing_text:
+        db["companies"][cid]["pricing_text"] = pricing_text
+        await _save_db_async(db, cid)
     return RedirectResponse(url="/dashboard?tab=pricing", status_code=302)
 
 @app.post("/dashboard/billing")
 async def save_billing(request: Request):
-    gate = require_company(request)
-    if gate:
-        return gate
-    company = get_company(request)
-    assert company is not None
+    db = await _load_db_async()
+    company = get_company(request, db)
+    if company is None:
+        return RedirectResponse(url="/login", status_code=302)
 
     form = await request.form()
     billing = {
@@ -2777,19 +3348,18 @@ async def save_billing(request: Request):
         "invoice_email": (form.get("invoice_email") or "").strip(),
     }
 
-    db = _load_db()
     cid = company["id"]
-    db["companies"][cid]["billing"] = billing
-    _save_db(db)
+    if db["companies"][cid].get("billing") != billing:
+        db["companies"][cid]["billing"] = billing
+        await _save_db_async(db, cid)
     return RedirectResponse(url="/dashboard?tab=billing", status_code=302)
 
 @app.post("/dashboard/architect/add")
 async def add_architect(request: Request):
-    gate = require_company(request)
-    if gate:
-        return gate
-    company = get_company(request)
-    assert company is not None
+    db = await _load_db_async()
+    company = get_company(request, db)
+    if company is None:
+        return RedirectResponse(url="/login", status_code=302)
 
     form = await request.form()
     name = (form.get("name") or "").strip()
@@ -2798,16 +3368,16 @@ async def add_architect(request: Request):
     if not name or not email:
         return RedirectResponse(url="/dashboard?tab=architects", status_code=302)
 
-    db = _load_db()
     cid = company["id"]
     a = {
         "id": _new_id("arch"),
         "name": name,
         "email": email,
-        "token": secrets.token_urlsafe(16),
+        "token": _new_token(16),
     }
     db["companies"][cid]["architects"].append(a)
-    _save_db(db)
+    _token_index(db)[a["token"]] = (cid, a["id"])
+    await _save_db_async(db, cid)
     return RedirectResponse(url="/dashboard", status_code=302)
 
 @app.get("/dashboard/architect/delete")
@@ -2820,8 +3390,14 @@ def delete_architect(request: Request, id: str = ""):
 
     db = _load_db()
     cid = company["id"]
-    db["companies"][cid]["architects"] = [a for a in db["companies"][cid].get("architects", []) if a.get("id") != id]
-    _save_db(db)
+    archs = db["companies"][cid].get("architects", [])
+    # Usuwamy w miejscu (bez budowania nowej listy); nieznane id nie przepisuje bazy
+    for i, a in enumerate(archs):
+        if a.get("id") == id:
+            _token_index(db).pop(a.get("token"), None)
+            del archs[i]
+            _save_db(db, cid)
+            break
     return RedirectResponse(url="/dashboard?tab=architects", status_code=302)
 
 
@@ -2833,9 +3409,8 @@ def dashboard_report_view(request: Request, id: str = ""):
     company = get_company(request)
     assert company is not None
 
-    _ensure_reports(company)
     rep = None
-    for r in company.get("reports") or []:
+    for r in _company_reports(company):
         if str(r.get("id") or "") == str(id or ""):
             rep = r
             break
@@ -2876,9 +3451,8 @@ def dashboard_report_download(request: Request, id: str = ""):
     company = get_company(request)
     assert company is not None
 
-    _ensure_reports(company)
     rep = None
-    for r in company.get("reports") or []:
+    for r in _company_reports(company):
         if str(r.get("id") or "") == str(id or ""):
             rep = r
             break
@@ -2934,7 +3508,7 @@ def billing_portal(request: Request):
     # Zapisz customer_id w bazie dla przyszłych wejść
     db["companies"][cid].setdefault("stripe", {})
     db["companies"][cid]["stripe"]["customer_id"] = customer_id
-    _save_db(db)
+    _save_db(db, cid)
 
     try:
         portal = stripe.billing_portal.Session.create(
@@ -2943,7 +3517,7 @@ def billing_portal(request: Request):
         )
         return RedirectResponse(url=portal.url, status_code=303)
     except Exception as e:
-        print(f"[STRIPE] billing_portal failed customer_id={customer_id} err={type(e).__name__}: {e}")
+        log.warning("[STRIPE] billing_portal failed customer_id=%s err=%s: %s", customer_id, type(e).__name__, e)
         return RedirectResponse(url="/dashboard?tab=plan", status_code=302)
 
 
@@ -2963,15 +3537,11 @@ def demo():
 @app.post("/demo/submit", response_class=HTMLResponse)
 async def demo_submit(request: Request):
     formdata = await request.form()
-    form_dict: Dict[str, Any] = {}
-    for k in formdata.keys():
-        v = formdata.get(k)
-        if k == "attachments":
-            continue
-        if v == "1":
-            form_dict[k] = True
-        else:
-            form_dict[k] = v
+    form_dict: Dict[str, Any] = {
+        k: _form_value(k, v)
+        for k, v in formdata.multi_items()
+        if k != "attachments"
+    }
     form_clean = _clean_form_dict(form_dict)
 
     report = """
@@ -3220,16 +3790,15 @@ franekstenzel@gmail.com
       </div>
     </div>
     """
-    return HTMLResponse(layout("Raport demo", body=body, nav=nav_links()))
+    return HTMLResponse(layout("Raport demo", body=body, nav=_NAV_LINKS))
 
 
 # =========================
 # 13B) Podgląd raportu + strony prawne
 # =========================
 
-@app.get("/report-demo", response_class=HTMLResponse)
-def report_demo(request: Request):
-    sample = """PODSUMOWANIE (fragment)
+# Przykładowy raport i cała treść strony są stałe – składane raz przy imporcie
+_REPORT_DEMO_SAMPLE = """PODSUMOWANIE (fragment)
 
 Cel: przygotować halę magazynowo-produkcyjną pod logistykę (24/7).
 Status danych: część informacji brakująca — poniżej lista pytań i dokumentów.
@@ -3254,7 +3823,7 @@ GOTOWA WIADOMOŚĆ DO KLIENTA (copy/paste)
 Dzień dobry, aby przygotować rzetelną wycenę projektu prosimy o uzupełnienie: (1) ... (2) ...
 W załączeniu lista pytań P0/P1 oraz dokumentów. Po otrzymaniu danych wracamy z wyceną w terminie ..."""
 
-    body = f'''
+_REPORT_DEMO_BODY = f'''
     <div class="wrap formwrap">
       <div class="headrow">
         <div>
@@ -3273,11 +3842,14 @@ W załączeniu lista pytań P0/P1 oraz dokumentów. Po otrzymaniu danych wracamy
           <button class="btn" data-copy="#demoReport">Kopiuj</button>
         </div>
         <div class="divider"></div>
-        <div class="codebox" id="demoReport">{esc(sample)}</div>
+        <div class="codebox" id="demoReport">{esc(_REPORT_DEMO_SAMPLE)}</div>
       </div>
     </div>
     '''
-    return HTMLResponse(layout("Raport demo", body=body, nav=nav_links(), request=request))
+
+@app.get("/report-demo", response_class=HTMLResponse)
+def report_demo(request: Request):
+    return HTMLResponse(layout("Raport demo", body=_REPORT_DEMO_BODY, nav=_NAV_LINKS, request=request))
 
 @app.get("/terms", response_class=HTMLResponse)
 def terms(request: Request):
@@ -3294,7 +3866,7 @@ def terms(request: Request):
       </div>
     </div>
     '''
-    return HTMLResponse(layout("Regulamin", body=body, nav=nav_links(), request=request))
+    return HTMLResponse(layout("Regulamin", body=body, nav=_NAV_LINKS, request=request))
 
 @app.get("/privacy", response_class=HTMLResponse)
 def privacy(request: Request):
@@ -3310,7 +3882,7 @@ def privacy(request: Request):
       </div>
     </div>
     '''
-    return HTMLResponse(layout("Prywatność", body=body, nav=nav_links(), request=request))
+    return HTMLResponse(layout("Prywatność", body=body, nav=_NAV_LINKS, request=request))
 
 @app.get("/security", response_class=HTMLResponse)
 def security(request: Request):
@@ -3324,18 +3896,21 @@ def security(request: Request):
       </div>
     </div>
     '''
-    return HTMLResponse(layout("Bezpieczeństwo", body=body, nav=nav_links(), request=request))
+    return HTMLResponse(layout("Bezpieczeństwo", body=body, nav=_NAV_LINKS, request=request))
 
 
 # =========================
 # 14) Formularz firmowy /f/{token}
 # =========================
 
-def find_by_token(token: str) -> tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
-    db = _load_db()
-    for c in db["companies"].values():
+def find_by_token(token: str, db: Optional[Dict[str, Any]] = None) -> tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    if db is None:
+        db = _load_db()
+    cid, aid = _token_index(db).get(token, (None, None))
+    c = db["companies"].get(cid) if cid else None
+    if c:
         for a in c.get("architects", []):
-            if a.get("token") == token:
+            if a.get("id") == aid and a.get("token") == token:
                 return c, a
     return None, None
 
@@ -3343,11 +3918,11 @@ def find_by_token(token: str) -> tuple[Optional[Dict[str, Any]], Optional[Dict[s
 def form_for_client(token: str, request: Request):
     company, architect = find_by_token(token)
     if not company or not architect:
-        return HTMLResponse(layout("Błąd", body='<div class="wrap formwrap"><h1>Nieprawidłowy link</h1><a class="btn" href="/">Strona główna</a></div>', nav=nav_links()), status_code=404)
+        return HTMLResponse(layout("Błąd", body='<div class="wrap formwrap"><h1>Nieprawidłowy link</h1><a class="btn" href="/">Strona główna</a></div>', nav=_NAV_LINKS), status_code=404)
 
     if not subscription_active(company):
         msg = "Dostęp jest czasowo zablokowany." if not ENABLE_FREE_PLAN else "Dostęp wymaga aktywnego planu."
-        return HTMLResponse(layout("Dostęp", body=f'<div class="wrap formwrap"><h1>Formularz niedostępny</h1><p class="muted">{msg}</p><a class="btn" href="/">Strona główna</a></div>', nav=nav_links()), status_code=403)
+        return HTMLResponse(layout("Dostęp", body=f'<div class="wrap formwrap"><h1>Formularz niedostępny</h1><p class="muted">{msg}</p><a class="btn" href="/">Strona główna</a></div>', nav=_NAV_LINKS), status_code=403)
 
     submit_token = _new_submit_token()
     return HTMLResponse(render_form(
@@ -3357,22 +3932,63 @@ def form_for_client(token: str, request: Request):
         submit_token=submit_token
     ))
 
+def _process_report_and_email(
+    company_id: str,
+    form_clean: Dict[str, Any],
+    pricing_text: str,
+    company: Dict[str, Any],
+    architect: Dict[str, Any],
+    delivery_id: str,
+) -> None:
+    """Zadanie w tle po submit_form: raport AI, email do architekta, zapis raportu w panelu firmy."""
+    try:
+        report = ai_report(form_clean, pricing_text=pricing_text, company=company, architect=architect)
+    except Exception as e:
+        log.error("[REPORT] generation failed delivery_id=%s err=%s: %s", delivery_id, type(e).__name__, e)
+        report = fallback_report(form_clean, pricing_text)
+
+    sent = False
+    if architect.get("email"):
+        sent = send_email(
+            architect["email"],
+            subject=f"[{APP_NAME}] Nowy brief – {company.get('name','')} / {architect.get('name','')}",
+            body=report,
+            delivery_id=delivery_id,
+        )
+    else:
+        log.warning("[EMAIL] FAIL delivery_id=%s reason=architect has no email in DB", delivery_id)
+
+    # Zapis raportu do historii (panel firmy)
+    try:
+        db = _load_db()
+        _store_report(
+            db,
+            company_id,
+            report_text=report,
+            form_clean=form_clean,
+            architect=architect,
+            delivery_id=delivery_id,
+            email_sent=sent,
+        )
+        _save_db(db, company_id)
+    except Exception as e:
+        log.error("[REPORT] store failed company_id=%s err=%s: %s", company_id, type(e).__name__, e)
+
 @app.post("/f/{token}", response_class=HTMLResponse)
-async def submit_form(token: str, request: Request):
-    company, architect = find_by_token(token)
+async def submit_form(token: str, request: Request, background: BackgroundTasks):
+    db = await _load_db_async()
+    company, architect = find_by_token(token, db)
     if not company or not architect:
         return HTMLResponse("Nieprawidłowy link", status_code=404)
 
     if not subscription_active(company):
         return HTMLResponse("Formularz niedostępny", status_code=403)
 
-    db = _load_db()
     company_id = company.get("id")
     if not company_id or company_id not in db.get("companies", {}):
         return HTMLResponse("Błąd danych firmy", status_code=500)
 
     c = db["companies"][company_id]
-    _ensure_usage_period(c)
     if _forms_remaining(c) <= 0:
         body = f"""
         <div class="wrap formwrap">
@@ -3381,10 +3997,18 @@ async def submit_form(token: str, request: Request):
           <div class="actions"><a class="btn" href="/">Strona główna</a></div>
         </div>
         """
-        return HTMLResponse(layout("Limit", body=body, nav=nav_links()), status_code=429)
+        return HTMLResponse(layout("Limit", body=body, nav=_NAV_LINKS), status_code=429)
 
     formdata = await request.form()
 
+    # Formularz parsujemy przed oznaczeniem tokenu i naliczeniem limitu – błąd w danych nie zabiera firmie formularza
+    form_dict: Dict[str, Any] = {
+        k: _form_value(k, v)
+        for k, v in formdata.multi_items()
+        if k != "attachments"
+    }
+    form_clean = _clean_form_dict(form_dict)
+
     submit_token = str(formdata.get("_submit_token") or "")
     if submit_token:
         if _mark_submit_token_used(db, submit_token):
@@ -3395,55 +4019,19 @@ async def submit_form(token: str, request: Request):
               <div class="actions"><a class="btn" href="/">Strona główna</a></div>
             </div>
             """
-            return HTMLResponse(layout("Status", body=body, nav=nav_links()))
-        _save_db(db)
+            return HTMLResponse(layout("Status", body=body, nav=_NAV_LINKS))
 
+    # Oznaczenie tokenu + licznik formularzy – jeden zapis przed generowaniem raportu
     _increment_forms_sent(db, company_id)
-    _save_db(db)
-
-    form_dict: Dict[str, Any] = {}
-    for k in formdata.keys():
-        if k == "attachments":
-            continue
-        v = formdata.get(k)
-        if v == "1":
-            form_dict[k] = True
-        else:
-            form_dict[k] = v
+    await _save_db_async(db, company_id)
 
-    form_clean = _clean_form_dict(form_dict)
     pricing_text = company.get("pricing_text", "") or ""
 
-    delivery_id = f"del_{secrets.token_urlsafe(8)}"
-    print(f"[FORM] received token={token} company_id={company_id} arch_email={architect.get('email')} delivery_id={delivery_id}")
+    delivery_id = f"del_{_new_token(8)}"
+    log.info("[FORM] received token=%s company_id=%s arch_email=%s delivery_id=%s", token, company_id, architect.get("email"), delivery_id)
 
-    report = ai_report(form_clean, pricing_text=pricing_text, company=company, architect=architect)
-
-    sent = False
-    if architect.get("email"):
-        sent = send_email(
-            architect["email"],
-            subject=f"[{APP_NAME}] Nowy brief – {company.get('name','')} / {architect.get('name','')}",
-            body=report,
-            delivery_id=delivery_id,
-        )
-    else:
-        print(f"[EMAIL] FAIL delivery_id={delivery_id} reason=architect has no email in DB")
-
-    # Zapis raportu do historii (panel firmy)
-    try:
-        _store_report(
-            db,
-            company_id,
-            report_text=report,
-            form_clean=form_clean,
-            architect=architect,
-            delivery_id=delivery_id,
-            email_sent=sent,
-        )
-        _save_db(db)
-    except Exception as e:
-        print(f"[REPORT] store failed company_id={company_id} err={type(e).__name__}: {e}")
+    # Raport AI + email + zapis do historii idą po wysłaniu odpowiedzi – inwestor nie czeka na API
+    background.add_task(_process_report_and_email, company_id, form_clean, pricing_text, company, architect, delivery_id)
 
     # Komunikat dla inwestora – profesjonalny, neutralny, bez odsyłania do logów
     body = """
@@ -3455,69 +4043,94 @@ async def submit_form(token: str, request: Request):
       </div>
     </div>
     """
-    return HTMLResponse(layout("Zgłoszenie przyjęte", body=body, nav=nav_links()))
+    return HTMLResponse(layout("Zgłoszenie przyjęte", body=body, nav=_NAV_LINKS))
 
 
 # =========================
 # 15) Stripe Checkout + Webhook – bez zmian
 # =========================
 
+# Stałe części sesji Checkout – liczone raz przy imporcie
+_CHECKOUT_RETURN_URL = f"{BASE_URL}/dashboard"
+_CHECKOUT_LINE_ITEMS = {
+    "monthly": [{"price": STRIPE_PRICE_ID_MONTHLY, "quantity": 1}] if STRIPE_PRICE_ID_MONTHLY else None,
+    "yearly": [{"price": STRIPE_PRICE_ID_YEARLY, "quantity": 1}] if STRIPE_PRICE_ID_YEARLY else None,
+}
+
 @app.get("/billing/checkout")
-def billing_checkout(request: Request, plan: str = "monthly"):
-    gate = require_company(request)
-    if gate:
-        return gate
-    company = get_company(request)
-    assert company is not None
+async def billing_checkout(request: Request, plan: str = "monthly"):
+    company = get_company(request, await _load_db_async())
+    if company is None:
+        return RedirectResponse(url="/login", status_code=302)
 
     if not stripe_ready():
         return RedirectResponse(url="/dashboard", status_code=302)
 
     stripe_init()
 
-    price_id = STRIPE_PRICE_ID_MONTHLY if plan == "monthly" else STRIPE_PRICE_ID_YEARLY
-    if not price_id:
+    line_items = _CHECKOUT_LINE_ITEMS["monthly" if plan == "monthly" else "yearly"]
+    if not line_items:
         return RedirectResponse(url="/dashboard", status_code=302)
 
     try:
-        session = stripe.checkout.Session.create(  # type: ignore
+        # Wywołanie HTTP do Stripe w wątku – nie blokuje pętli zdarzeń
+        session = await run_in_threadpool(
+            stripe.checkout.Session.create,  # type: ignore
             mode="subscription",
-            line_items=[{"price": price_id, "quantity": 1}],
-            success_url=f"{BASE_URL}/dashboard",
-            cancel_url=f"{BASE_URL}/dashboard",
+            line_items=line_items,
+            success_url=_CHECKOUT_RETURN_URL,
+            cancel_url=_CHECKOUT_RETURN_URL,
             customer_email=company.get("email"),
             metadata={"company_id": company.get("id"), "plan": plan},
             subscription_data={"metadata": {"company_id": company.get("id"), "plan": plan}},
         )
         return RedirectResponse(url=session.url, status_code=303)  # type: ignore
     except Exception as e:
-        print(f"[STRIPE] checkout error: {type(e).__name__}: {e}")
+        log.error("[STRIPE] checkout error: %s: %s", type(e).__name__, e)
         return RedirectResponse(url="/dashboard", status_code=302)
 
+_STRIPE_HANDLED_EVENTS = frozenset({
+    "checkout.session.completed",
+    "customer.subscription.deleted",
+    "customer.subscription.updated",
+})
+
 @app.post("/stripe/webhook")
 async def stripe_webhook(request: Request):
     if not stripe_ready():
         return PlainTextResponse("stripe disabled", status_code=200)
 
-    stripe_init()
-
     payload = await request.body()
     sig = request.headers.get("stripe-signature", "")
 
+    if not _verify_stripe_signature(payload, sig, STRIPE_WEBHOOK_SECRET):
+        log.warning("[STRIPE] webhook bad signature")
+        return PlainTextResponse("bad signature", status_code=400)
     try:
-        event = stripe.Webhook.construct_event(payload, sig, STRIPE_WEBHOOK_SECRET)  # type: ignore
+        event = orjson.loads(payload) if orjson is not None else json.loads(payload)
     except Exception as e:
-        print(f"[STRIPE] webhook bad signature: {type(e).__name__}: {e}")
-        return PlainTextResponse("bad signature", status_code=400)
+        log.warning("[STRIPE] webhook bad payload: %s: %s", type(e).__name__, e)
+        return PlainTextResponse("bad payload", status_code=400)
+    if not isinstance(event, dict):
+        return PlainTextResponse("bad payload", status_code=400)
 
     etype = event.get("type")
-    data = event.get("data", {}).get("object", {})
+    # Zdarzenia, których nie obsługujemy, kończymy bez dotykania bazy
+    if etype not in _STRIPE_HANDLED_EVENTS:
+        return PlainTextResponse("ok", status_code=200)
+    data = event.get("data")
+    data = data.get("object") if isinstance(data, dict) else None
+    if not isinstance(data, dict) or not isinstance(data.get("metadata") or {}, dict):
+        log.warning("[STRIPE] webhook bad payload: type=%s data.object is not a valid object", etype)
+        return PlainTextResponse("bad payload", status_code=400)
 
     company_id = (data.get("metadata") or {}).get("company_id") or ""
+    if not isinstance(company_id, str):
+        return PlainTextResponse("bad payload", status_code=400)
     if not company_id:
         return PlainTextResponse("ok", status_code=200)
 
-    db = _load_db()
+    db = await _load_db_async()
     if company_id not in db["companies"]:
         return PlainTextResponse("ok", status_code=200)
 
@@ -3530,8 +4143,8 @@ async def stripe_webhook(request: Request):
         db["companies"][company_id]["stripe"]["customer_id"] = data.get("customer", "") or ""
         db["companies"][company_id]["stripe"]["subscription_id"] = data.get("subscription", "") or ""
         db["companies"][company_id]["plan"] = chosen_plan
-        _save_db(db)
-        print(f"[STRIPE] company_id={company_id} status=active plan={chosen_plan} via checkout.session.completed")
+        await _save_db_async(db, company_id)
+        log.info("[STRIPE] company_id=%s status=active plan=%s via checkout.session.completed", company_id, chosen_plan)
 
     if etype in ("customer.subscription.deleted", "customer.subscription.updated"):
         status = data.get("status", "") or ""
@@ -3545,8 +4158,8 @@ async def stripe_webhook(request: Request):
         elif status not in ("active", "trialing"):
             db["companies"][company_id]["plan"] = ("free" if ENABLE_FREE_PLAN else "none")
 
-        _save_db(db)
-        print(f"[STRIPE] company_id={company_id} status={status} via {etype}")
+        await _save_db_async(db, company_id)
+        log.info("[STRIPE] company_id=%s status=%s via %s", company_id, status, etype)
 
     return PlainTextResponse("ok", status_code=200)
 